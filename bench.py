@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import contextlib
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+import detection_code as dc
+import cli
+
+# app methods timed per call, reported under these stage names. Calls on
+# the decode/write pools overlap, so a stage can exceed the wall time.
+STAGES = {
+    'read_frame': 'decode',
+    'classify_scene': 'scene',
+    'is_night_by_color': 'color_score',
+    'predict': 'inference',
+    'write_image': 'write',
+    'annotate': 'annotate',
+    'encode': 'encode',
+    'write_summary': 'report',
+}
+
+
+class _Tensor():
+    # The part of a torch tensor make_det uses
+    def __init__(self, values):
+        self.values = values
+
+    def cpu(self):
+        return self
+
+    def tolist(self):
+        return self.values
+
+
+class _Boxes():
+    def __init__(self, conf, xyxy, cls):
+        self.conf, self.xyxy, self.cls = _Tensor(conf), _Tensor(xyxy), _Tensor(cls)
+
+
+class _Result():
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class StubModel():
+    """
+    Stands in for a YOLO model: one centred box whose confidence follows the
+    frame's brightness, after latency seconds per frame. Keeps benchmark
+    numbers about the pipeline rather than the network.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def __call__(self, imgs, **kwargs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        if self.latency:
+            time.sleep(self.latency * len(imgs))
+        results = []
+        for img in imgs:
+            h, w = img.shape[:2]
+            conf = float(img[::64, ::64].mean()) / 255
+            results.append(_Result(_Boxes([conf], [[w/4, h/4, 3*w/4, 3*h/4]], [0])))
+        return results
+
+
+class StageTimer():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = {}
+        self.calls = {}
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed
+                    self.calls[stage] = self.calls.get(stage, 0) + 1
+        return timed
+
+    def report(self):
+        return {stage: {'seconds': round(self.seconds[stage], 4),
+                        'calls': self.calls[stage],
+                        'ms_per_call': round(1000 * self.seconds[stage] / self.calls[stage], 3)}
+                for stage in self.seconds}
+
+
+def synthetic_image(index, size, night, rng):
+    """
+    Smooth gradients with sensor noise, in colour for day frames and grey
+    (as IR frames are) for night frames. Every 3rd day frame is bright.
+    """
+    w, h = size
+    x = np.linspace(0, 1, w, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, h, dtype=np.float32)[:, None]
+    base = 0.5 * x + 0.5 * y
+    if night:
+        grey = 40 + 80 * base + rng.normal(0, 6, (h, w)).astype(np.float32)
+        img = np.repeat(grey[:, :, None], 3, axis=2)
+    else:
+        level = 160 if index % 3 == 0 else 70
+        tint = rng.uniform(0.4, 1.0, 3).astype(np.float32)
+        img = level * (0.5 + base[:, :, None]) * tint + rng.normal(0, 6, (h, w, 3)).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def make_corpus(folder, count, size, night_ratio=0.3, seed=0, threads=4):
+    """
+    Write count JPEGs (IMG_0001.JPG, ...) to folder unless it already holds
+    them, so repeated runs of the same corpus skip the generation.
+    """
+    os.makedirs(folder, exist_ok=True)
+    names = [f'IMG_{i + 1:04d}.JPG' for i in range(count)]
+    nights = int(round(count * night_ratio))
+
+    def write(i):
+        path = os.path.join(folder, names[i])
+        if not os.path.isfile(path):
+            rng = np.random.default_rng(seed + i)
+            cv2.imwrite(path, synthetic_image(i, size, i < nights, rng), [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        list(pool.map(write, range(count)))
+    return names
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(corpus, output, model='stub', weights=None, latency=0.0, **kwargs):
+    """
+    Run app end to end on corpus with the stages in STAGES timed. model
+    'stub' puts StubModel in the model cache, weights loads that file (a
+    small YOLO) for both scenes instead, otherwise the named model is used.
+    kwargs are app arguments. Returns the result dict.
+    """
+    kwargs.setdefault('output_mode', 'Original images')
+    kwargs.setdefault('day_conf', 15)
+    kwargs.setdefault('night_conf', 30)
+    name = 'Best' if model == 'stub' else model
+    if model == 'stub' or weights:
+        if kwargs.get('workers', 1) > 1:
+            raise ValueError('stub and custom weights only live in this process, use workers=1')
+        device = dc.resolve_device(kwargs.get('device', 'auto'))
+        for scene in ('day', 'night'):
+            dc._model_cache[(name, scene, device, kwargs.get('backend', 'pytorch'))] = (
+                StubModel(latency) if model == 'stub' else dc.load_model(weights, device, kwargs.get('backend', 'pytorch')))
+
+    with contextlib.redirect_stdout(sys.stderr):
+        runner = dc.app(model=name, input_path=corpus, output_path=output, **kwargs)
+    timer = StageTimer()
+    for method, stage in STAGES.items():
+        setattr(runner, method, timer.wrap(stage, getattr(runner, method)))
+    start = time.perf_counter()
+    # app reports on stdout, which carries the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        runner.main()
+    wall = time.perf_counter() - start
+    count = len(dc.list_images(corpus))
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'model': weights or model,
+        'images': count,
+        'settings': {k: v for k, v in kwargs.items() if k != 'progress_callback'},
+        'wall_seconds': round(wall, 3),
+        'images_per_sec': round(count / wall, 2) if wall else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': timer.report(),
+        # The engine's own counters and queue depths (RunMetrics)
+        'metrics': {k: v for k, v in runner.metrics.snapshot().items() if k in ('counters', 'queues')},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench', description='Wildscan throughput benchmark')
+    parser.add_argument('--images', type=int, default=200, help='Synthetic corpus size')
+    parser.add_argument('--size', default='2560x1920', help='Image size WxH (camera traps shoot 1920x1080 to 4000x3000)')
+    parser.add_argument('--night-ratio', type=float, default=0.3, help='Share of greyscale night frames')
+    parser.add_argument('--corpus', default=None, help='Corpus folder (default: one per size in the temp folder)')
+    parser.add_argument('--model', default='stub', choices=['stub', *dc.models_bl_dict])
+    parser.add_argument('--weights', default=None, help='Small YOLO weights to use for both scenes instead')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per frame the stub model sleeps')
+    parser.add_argument('--output-mode', default='Original images', choices=['Original images', 'Annotated images'])
+    parser.add_argument('--day-conf', type=float, default=15)
+    parser.add_argument('--night-conf', type=float, default=30)
+    parser.add_argument('--keep', action='store_true', help='Keep the output folder')
+    parser.add_argument('--out', default=None, help='Write the JSON result here as well as to stdout')
+    cli.add_app_arguments(parser, omit_defaults=True,
+                          skip=('model', 'input_path', 'output_path', 'output_mode', 'day_conf', 'night_conf'))
+    args = parser.parse_args()
+
+    w, h = (int(v) for v in args.size.lower().split('x'))
+    corpus = args.corpus or os.path.join(tempfile.gettempdir(), f'wildscan-bench-{args.images}-{w}x{h}-{args.night_ratio}')
+    # In a child process, peak_rss_mb of this one only covers the measured run
+    child = multiprocessing.get_context('spawn').Process(
+        target=make_corpus, args=(corpus, args.images, (w, h), args.night_ratio),
+        kwargs={'threads': os.cpu_count() or 4})
+    child.start()
+    child.join()
+    if child.exitcode != 0:
+        sys.exit(f'generating the corpus in {corpus} failed')
+    output = tempfile.mkdtemp(prefix='wildscan-bench-out-')
+    try:
+        kwargs = cli.app_kwargs(args)
+        kwargs.pop('model')
+        result = benchmark(corpus, output, args.model, args.weights, args.latency, **kwargs)
+    finally:
+        if not args.keep:
+            shutil.rmtree(output, ignore_errors=True)
+    result['corpus'] = {'path': corpus, 'size': [w, h], 'night_ratio': args.night_ratio}
+    text = json.dumps(result, indent=4)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
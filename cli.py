@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import uuid
+import signal
+import inspect
+import argparse
+import traceback
+
+import detection_code as dc
+
+# app parameters that cannot come from the command line
+_skip = {'self', 'progress_callback', 'progress_detail', 'control'}
+_choices = {
+    'model': list(dc.models_bl_dict),
+    'output_mode': ['Original images', 'Annotated images'],
+    'device': None,
+    'backend': ['pytorch', *dc.export_suffix],
+    'placement': list(dc.placements),
+    'preview_mode': ['none', 'alongside', 'only'],
+    'sequence_policy': list(dc.sequence_policies),
+}
+_spool_dirs = ('incoming', 'running', 'done', 'failed', 'tmp')
+
+
+def progress(processed: int, total: int, event: dict = None):
+    text = f'\rProcessed {processed}/{total}'
+    if event is not None and event['images_per_sec'] > 0:
+        text += f" {event['images_per_sec']:.1f} img/s"
+        if event['eta'] is not None:
+            text += f", ETA {int(event['eta'])}s"
+    print(text, end='', flush=True)
+
+
+def add_app_arguments(parser, omit_defaults=False, skip=()):
+    """
+    One option per app parameter, generated from its signature so the CLI
+    always exposes all of them. Required parameters become required options.
+    omit_defaults leaves options that were not given out of the namespace,
+    skip names parameters the caller provides itself.
+    """
+    for name, param in inspect.signature(dc.app.__init__).parameters.items():
+        if name in _skip or name in skip:
+            continue
+        flag = '--' + name.replace('_', '-')
+        default = param.default
+        required = default is inspect.Parameter.empty
+        if omit_defaults and not required:
+            default = argparse.SUPPRESS
+        kind = param.annotation if param.annotation is not inspect.Parameter.empty else type(param.default)
+        if kind is bool:
+            parser.add_argument(flag, action=argparse.BooleanOptionalAction, default=default)
+        elif isinstance(param.default, tuple):
+            parser.add_argument(flag, nargs='*', default=default, metavar=name.upper())
+        else:
+            parser.add_argument(flag, required=required, default=None if required else default,
+                                type=kind if kind in (int, float) else str,
+                                choices=_choices.get(name))
+
+
+def app_kwargs(args):
+    names = [n for n in inspect.signature(dc.app.__init__).parameters if n not in _skip]
+    return {n: getattr(args, n) for n in names if hasattr(args, n)}
+
+
+def interrupt_cancels(control):
+    # First Ctrl+C stops the run cleanly (partial results are written), a second one aborts
+    def handler(signum, frame):
+        print('\nCancelling, finishing the images in progress (Ctrl+C again to abort)')
+        control.cancel()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGINT, handler)
+
+
+def cmd_run(args):
+    control = dc.RunControl()
+    interrupt_cancels(control)
+    runner = dc.app(progress_callback=progress, progress_detail=True, control=control, **app_kwargs(args))
+    message = runner.main()
+    print()
+    print(message)
+
+
+def cmd_rethreshold(args):
+    message = dc.rethreshold(args.store,
+                             day_conf=args.day_conf,
+                             night_conf=args.night_conf,
+                             output_path=args.output,
+                             output_mode=args.output_mode,
+                             progress_callback=progress,
+                             verbose=args.verbose)
+    print()
+    print(message)
+
+
+def cmd_node(args):
+    kwargs = app_kwargs(args)
+    kwargs['input_path'] = os.path.abspath(kwargs['input_path'])
+    kwargs['output_path'] = os.path.abspath(kwargs['output_path'])
+    kwargs.pop('timestamp', None)
+    kwargs['control'] = dc.RunControl()
+    interrupt_cancels(kwargs['control'])
+    message = dc.run_node(args.work_dir, args.chunk_size, args.lease_seconds, args.poll, args.node, **kwargs)
+    print()
+    print(message)
+
+
+def cmd_merge(args):
+    print(dc.merge_parts(args.work_dir))
+
+
+def make_spool(spool):
+    for name in _spool_dirs:
+        os.makedirs(os.path.join(spool, name), exist_ok=True)
+
+
+def submit_job(spool, job):
+    """
+    Queue a job (app keyword arguments) in a spool directory. Written to tmp
+    first and renamed into incoming so the daemon never sees a partial file.
+    Returns the job id.
+    """
+    make_spool(spool)
+    job_id = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+    tmp = os.path.join(spool, 'tmp', job_id + '.json')
+    with open(tmp, 'w') as f:
+        json.dump(job, f, indent=4)
+    os.replace(tmp, os.path.join(spool, 'incoming', job_id + '.json'))
+    return job_id
+
+
+def serve(spool, poll=1.0, defaults=None, warm=None, once=False):
+    """
+    Process jobs from spool/incoming back to back in this process, so the
+    models stay loaded between jobs. A job is claimed by renaming it into
+    running, then moved to done or failed with the result message added.
+    """
+    make_spool(spool)
+    if warm:
+        model, device, backend = warm
+        for scene in ('day', 'night'):
+            dc.get_model(model, scene, dc.resolve_device(device), backend)
+    print(f'Wildscan daemon watching {os.path.abspath(spool)}')
+    while True:
+        jobs = sorted(os.listdir(os.path.join(spool, 'incoming')))
+        if not jobs:
+            if once:
+                return
+            time.sleep(poll)
+            continue
+        name = jobs[0]
+        running = os.path.join(spool, 'running', name)
+        try:
+            os.rename(os.path.join(spool, 'incoming', name), running)
+        except FileNotFoundError:
+            # Claimed by another daemon on the same spool
+            continue
+        text = job = None
+        try:
+            with open(running) as f:
+                text = f.read()
+            job = json.loads(text)
+            print(f'job {name}: {job.get("input_path")}')
+            runner = dc.app(**{**(defaults or {}), **job})
+            result = runner.main()
+            status = 'done'
+        except Exception:
+            result = traceback.format_exc()
+            status = 'failed'
+        if not isinstance(job, dict):
+            # Not a JSON object, keep what the file held next to the traceback
+            job = {'job': text if job is None else job}
+        job['result'] = result
+        print(result)
+        with open(running, 'w') as f:
+            json.dump(job, f, indent=4)
+        os.replace(running, os.path.join(spool, status, name))
+
+
+def cmd_daemon(args):
+    warm = (args.warm, args.device, args.backend) if args.warm else None
+    serve(args.spool, args.poll, {'device': args.device, 'backend': args.backend}, warm, args.once)
+
+
+def cmd_submit(args):
+    job = app_kwargs(args)
+    # Paths are resolved here, the daemon may run from another directory
+    job['input_path'] = os.path.abspath(job['input_path'])
+    job['output_path'] = os.path.abspath(job['output_path'])
+    print(submit_job(args.spool, job))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='wildscan', description='Wildscan command line')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='Process a folder of images')
+    add_app_arguments(p)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser('rethreshold',
+                       help='Re-sort a previous run from its detections store without running the models')
+    p.add_argument('store', help='detections_*.npz written by a run')
+    p.add_argument('--day-conf', type=float, required=True, help='Day confidence threshold in percent')
+    p.add_argument('--night-conf', type=float, required=True, help='Night confidence threshold in percent')
+    p.add_argument('--output', default=None, help='Output folder (default: folder of the store)')
+    p.add_argument('--output-mode', default=None, choices=['Original images', 'Annotated images'],
+                   help='Output mode (default: mode of the original run)')
+    p.add_argument('--verbose', action='store_true')
+    p.set_defaults(func=cmd_rethreshold)
+
+    p = sub.add_parser('daemon', help='Keep the models loaded and run jobs queued in a spool directory')
+    p.add_argument('spool', help='Spool directory (incoming/running/done/failed are created in it)')
+    p.add_argument('--poll', type=float, default=1.0, help='Seconds between checks for new jobs')
+    p.add_argument('--device', default='auto')
+    p.add_argument('--backend', default='pytorch', choices=_choices['backend'])
+    p.add_argument('--warm', default=None, choices=_choices['model'],
+                   help='Load this model at startup instead of on the first job')
+    p.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+    p.set_defaults(func=cmd_daemon)
+
+    p = sub.add_parser('submit', help='Queue a job for a running daemon')
+    p.add_argument('spool', help='Spool directory of the daemon')
+    add_app_arguments(p, omit_defaults=True)
+    p.set_defaults(func=cmd_submit)
+
+    p = sub.add_parser('node', help='Work on a run shared by several machines through a common folder')
+    p.add_argument('work_dir', help='Shared folder holding the plan, leases and partial results')
+    p.add_argument('--chunk-size', type=int, default=500, help='Images per claimed chunk')
+    p.add_argument('--lease-seconds', type=float, default=300,
+                   help='A chunk whose lease is not refreshed for this long is taken over')
+    p.add_argument('--poll', type=float, default=5.0, help='Seconds between checks while other nodes work')
+    p.add_argument('--node', default=None, help='Name of this node (default: host-pid)')
+    add_app_arguments(p)
+    p.set_defaults(func=cmd_node)
+
+    p = sub.add_parser('merge', help='Build the report of a finished multi-node run')
+    p.add_argument('work_dir')
+    p.set_defaults(func=cmd_merge)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    args.func(args)
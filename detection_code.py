@@ -2,21 +2,36 @@ import os
 import csv
 import json
 import time
+import queue
+import hashlib
 import shutil
+import socket
+import multiprocessing
+import re
+import math
+import inspect
 import pathlib
+import zipfile
+import tempfile
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
 try:
     import numpy as np
     import pandas as pd
     from ultralytics import YOLO
     import cv2
+    from PIL import Image
 except ModuleNotFoundError:
     import subprocess, sys
-    subprocess.check_call(sys.executable, '-m', 'pip', 'install', 'opencv-python', 'pandas', 'numpy', 'ultralytics')
+    subprocess.check_call(sys.executable, '-m', 'pip', 'install', 'opencv-python', 'pandas', 'numpy', 'ultralytics', 'pillow')
     import cv2
     import numpy as np
     import pandas as pd
     from ultralytics import YOLO
+    from PIL import Image
 
 models_bl_dict = {
         'Best': {
@@ -29,6 +44,272 @@ models_bl_dict = {
                 }
         }
 
+# Training input size, see Model/*/args.yaml
+MODEL_IMGSZ = 1280
+
+# Exported artifacts are written next to the weights by ultralytics
+export_suffix = {
+        'onnx': '.onnx',
+        'openvino': '_openvino_model'
+        }
+
+def resolve_device(device="auto"):
+    # auto -> cuda when available, anything cuda falls back to cpu when it is not
+    if device != "auto" and not device.startswith("cuda"):
+        return device
+    try:
+        import torch
+        has_cuda = torch.cuda.is_available()
+    except ModuleNotFoundError:
+        has_cuda = False
+    if device == "auto":
+        return "cuda" if has_cuda else "cpu"
+    if not has_cuda:
+        print(f"{device} requested but CUDA is not available, falling back to cpu")
+        return "cpu"
+    return device
+
+def export_model(weights, backend):
+    """
+    Export weights to an ONNX/OpenVINO artifact once and return its path.
+    The artifact is reused on later runs for as long as it is newer than the weights.
+    """
+    stem, ext = os.path.splitext(weights)
+    target = stem + export_suffix[backend]
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(weights):
+        return target
+    print(f'exporting {weights} to {backend}')
+    # ultralytics names the artifact after the weights, so export a private copy
+    # and move the finished artifact into place: an interrupted export never
+    # leaves a partial artifact that looks newer than the weights
+    tmp_weights = f"{stem}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+    shutil.copy2(weights, tmp_weights)
+    try:
+        exported = str(YOLO(tmp_weights).export(format=backend, imgsz=MODEL_IMGSZ, dynamic=True))
+        if os.path.isdir(exported) and os.path.isdir(target):
+            # os.replace only replaces an empty directory
+            shutil.rmtree(target, ignore_errors=True)
+        os.replace(exported, target)
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_weights)
+    return target
+
+def load_model(weights, device="cpu", backend="pytorch"):
+    if backend == "pytorch":
+        model = YOLO(weights)
+        model.to(device)
+        return model
+    if backend not in export_suffix:
+        raise ValueError(f"Unknown backend {backend}, expected pytorch, {', '.join(export_suffix)}")
+    return YOLO(export_model(weights, backend), task="detect")
+
+# Models stay loaded for the life of the process so successive app runs
+# (e.g. every Run click in the GUI) skip the checkpoint load.
+# Keyed by (model name, scene, device, backend)
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+
+def get_model(name, scene, device="cpu", backend="pytorch"):
+    # Loaded on first use, so an all-day folder never loads the night model.
+    # scene "screen" loads name as a weights path (the cascade screening model)
+    key = (name, scene, device, backend)
+    with _model_cache_lock:
+        if key not in _model_cache:
+            weights = name if scene == "screen" else models_bl_dict[name][scene]
+            _model_cache[key] = load_model(weights, device, backend)
+        return _model_cache[key]
+
+def evict_models(name=None, scene=None, device=None, backend=None):
+    """
+    Drop cached models matching every given field, all of them when called
+    without arguments. Returns the number of models evicted.
+    """
+    wanted = (name, scene, device, backend)
+    with _model_cache_lock:
+        keys = [key for key in _model_cache if all(w is None or w == k for w, k in zip(wanted, key))]
+        for key in keys:
+            del _model_cache[key]
+    if keys and any(key[2].startswith("cuda") for key in keys):
+        import torch
+        torch.cuda.empty_cache()
+    return len(keys)
+
+# Columns of the streamed results and the XLSX summary, with their types
+REPORT_COLUMNS = {
+        "image_name": str,
+        "scene": str,
+        "animals_detected": int,
+        "max_confidence": float,
+        }
+
+# Extra columns when frames are grouped into trigger events
+EVENT_COLUMNS = {
+        "event_id": int,
+        "event_size": int,
+        "reused_from": str,
+        }
+
+# Extra column in cascade mode, "screen" or "full": the pass that decided the image
+CASCADE_COLUMNS = {
+        "stage": str,
+        }
+
+# Extra columns once a clip has been processed: sampled frame with the
+# highest confidence, its time in seconds and the number of frames checked
+VIDEO_COLUMNS = {
+        "best_frame": int,
+        "best_time": float,
+        "frames_checked": int,
+        }
+
+sequence_policies = ("off", "group", "reuse", "reuse_empty")
+
+def capture_time(path):
+    # EXIF DateTimeOriginal (else DateTime) as a timestamp, file mtime when there is none
+    try:
+        with Image.open(path) as im:
+            exif = im.getexif()
+            value = exif.get_ifd(0x8769).get(0x9003) or exif.get(0x0132)
+        if value:
+            return datetime.strptime(str(value).strip('\x00 '), "%Y:%m:%d %H:%M:%S").timestamp()
+    except (OSError, ValueError, SyntaxError):
+        pass
+    return os.path.getmtime(path)
+
+def dhash(path):
+    # 64 bit difference hash of a 1/8 scale greyscale decode, None if unreadable
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        return None
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+def _natural_key(name):
+    # IMG_9.JPG sorts before IMG_10.JPG
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def group_events(paths, gap=10.0, hash_threshold=6, threads=4, use_exif=True):
+    """
+    Cluster camera trap triggers into events. Frames are ordered by folder
+    (one camera), capture time then filename sequence (burst frames share a
+    second) and a new event starts in a new folder or after a gap of more
+    than gap seconds. Inside an event a frame of the same scene (day/night,
+    see classify_scenes) whose dHash is within hash_threshold bits of the
+    event's current reference frame is a near duplicate of it, otherwise it
+    becomes the reference. Returns [(event_id, event_size, index of
+    reference or None)] aligned with paths.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        times = list(pool.map(capture_time, paths))
+        hashes = list(pool.map(dhash, paths))
+    # A duplicate takes its reference's scene and boxes, so it must share the scene
+    scenes = [is_night for is_night, _ in classify_scenes(paths, use_exif=use_exif, threads=threads)]
+    folders = [os.path.dirname(path) for path in paths]
+    order = sorted(range(len(paths)), key=lambda i: (folders[i], times[i], _natural_key(os.path.basename(paths[i]))))
+    events = []
+    for i in order:
+        if not events or folders[i] != folders[events[-1][-1]] or times[i] - times[events[-1][-1]] > gap:
+            events.append([])
+        events[-1].append(i)
+    result = [None] * len(paths)
+    for event_id, members in enumerate(events, start=1):
+        ref = None
+        for i in members:
+            duplicate = (ref is not None and hashes[i] is not None and hashes[ref] is not None
+                         and scenes[i] == scenes[ref]
+                         and bin(hashes[i] ^ hashes[ref]).count('1') <= hash_threshold)
+            if not duplicate:
+                ref = i
+            result[i] = (event_id, len(members), ref if duplicate else None)
+    return result
+
+# Long side of the thumbnail the scene colour score is measured on
+SCENE_THUMB = 64
+
+def color_score(img):
+    """
+    Mean of |r-g|, |r-b| and |g-b| over a small thumbnail of img (BGR).
+    Greyscale/IR frames score ~0. One pass over int16 pixels, uint8
+    differences would wrap around.
+    """
+    if img.ndim == 2 or img.shape[2] == 1:
+        return 0.0
+    if max(img.shape[:2]) > SCENE_THUMB:
+        scale = SCENE_THUMB / max(img.shape[:2])
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    px = img.reshape(-1, 3).astype(np.int16)
+    # b-g, g-r, r-b in one subtraction
+    return float(np.abs(px - px[:, [1, 2, 0]]).sum(axis=1).mean() / 3)
+
+def exif_scene(path):
+    """
+    "night" when the file itself says so: a greyscale JPEG, or EXIF Flash
+    fired (camera traps only fire their IR/white flash in the dark).
+    None when it does not, the colour score decides then.
+    """
+    try:
+        with Image.open(path) as im:
+            if im.mode in ("1", "L", "LA", "I", "I;16"):
+                return "night"
+            flash = im.getexif().get_ifd(0x8769).get(0x9209)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    if flash is not None and int(flash) & 1:
+        return "night"
+    return None
+
+def classify_scenes(paths, color_thresh=10, use_exif=True, threads=4):
+    """
+    Batch scene classification without a full decode: EXIF first, else the
+    colour score of a 1/8 scale JPEG decode. Returns [(is_night, color_score)]
+    in the order of paths, color_score is -1 when EXIF decided and None when
+    the file could not be read.
+    """
+    def classify(path):
+        if use_exif and exif_scene(path) == "night":
+            return True, -1.0
+        img = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_8)
+        if img is None:
+            return None, None
+        score = color_score(img)
+        return score < color_thresh, score
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        return list(pool.map(classify, paths))
+
+# JPEG DCT domain scaling, decode factor -> imread flag
+reduced_flags = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+        }
+
+def read_reduced(path, min_side=MODEL_IMGSZ):
+    """
+    Decode a JPEG at the smallest DCT scale (1/2, 1/4 or 1/8) whose long side
+    is still at least min_side, other formats at full size.
+    Returns (img, scale) with scale = original px per decoded px, or None.
+    """
+    factor = 1
+    long_side = None
+    if path.lower().endswith((".jpg", ".jpeg")):
+        try:
+            with Image.open(path) as im:
+                long_side = max(im.size)
+        except OSError:
+            return None
+        for f in (8, 4, 2):
+            if long_side / f >= min_side:
+                factor = f
+                break
+    img = cv2.imread(path, reduced_flags[factor])
+    if img is None:
+        return None
+    scale = long_side / max(img.shape[:2]) if factor > 1 else 1.0
+    return img, scale
+
 colour = (
     (0, 0, 255),      # Red
     (0, 255, 0),      # Green
@@ -52,6 +333,844 @@ colour = (
     (144, 238, 144),  # Light Green
 )
 
+_END = object()
+
+def prefetch(items, read_fn, threads=4, depth=32, gauge=None):
+    """
+    Yields (key, read_fn(*args)) for each (key, *args) in items, in order.
+    read_fn runs on a thread pool ahead of the consumer, at most depth results
+    are held at once so memory is capped by the queue rather than the folder size.
+    gauge(n) is given the queue length at every item taken. An exception
+    raised by items is raised to the consumer after the items before it.
+    """
+    q = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="wildscan-read")
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def feed():
+        error = None
+        try:
+            for key, *args in items:
+                if not put((key, pool.submit(read_fn, *args))):
+                    return
+        except BaseException as e:
+            # A failing listing must not end the run as if the input were exhausted
+            error = e
+        finally:
+            put((_END, error))
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        while True:
+            if gauge is not None:
+                gauge(q.qsize())
+            key, fut = q.get()
+            if key is _END:
+                if fut is not None:
+                    raise fut
+                break
+            yield key, fut.result()
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ImageWriter():
+    """
+    Runs write_fn on a pool of threads so encoding and disk writes overlap
+    inference. At most max_pending writes are queued, submit() blocks past that.
+    threads=0 writes on the calling thread. on_done(*result) is called after
+    every finished item, from whichever thread finished it, on_failed(*result)
+    instead when write_fn raised (the error is raised again by close()).
+    """
+    def __init__(self, write_fn, threads=2, max_pending=32, on_done=None, on_failed=None):
+        self.write_fn = write_fn
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.errors = []
+        # Submitted and not finished yet
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wildscan-write") if threads > 0 else None
+
+    def _run(self, args, result):
+        written = False
+        try:
+            self.write_fn(*args)
+            written = True
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            if self.pool is not None:
+                with self._pending_lock:
+                    self.pending -= 1
+                self._slots.release()
+            if written:
+                self.done(*result)
+            elif self.on_failed is not None:
+                self.on_failed(*result)
+
+    def submit(self, args, result=()):
+        if self.pool is None:
+            return self._run(args, result)
+        self._slots.acquire()
+        with self._pending_lock:
+            self.pending += 1
+        self.pool.submit(self._run, args, result)
+
+    def done(self, *result):
+        # Report an item that finished without anything to write
+        if self.on_done is not None:
+            self.on_done(*result)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+class DetectionStore():
+    """
+    Columnar store of the raw boxes of a run, saved as a compressed .npz so
+    thresholds can be re-applied later without running the models again.
+      per image: image, scene, color_score
+      per box:   box_image (row of its image), xyxy, conf, cls
+    meta holds the run settings (input folder, model, thresholds, mode).
+    While a run adds images the box columns are appended to temporary
+    files next to path, only the per image columns stay in memory.
+    """
+    # Box column -> (dtype, shape of one box)
+    box_columns = {
+        'box_image': (np.int32, ()),
+        'xyxy': (np.float32, (4,)),
+        'conf': (np.float32, ()),
+        'cls': (np.int16, ()),
+    }
+
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.meta = meta or {}
+        self.images, self.scenes, self.color_scores = [], [], []
+        self._spill = None
+        self._offsets = None
+
+    def add(self, filename, scene, color_score, xyxy, conf, cls):
+        if self._spill is None:
+            self._spill = {name: tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)))
+                           for name in self.box_columns}
+        row = len(self.images)
+        self.images.append(filename)
+        self.scenes.append(scene)
+        self.color_scores.append(color_score)
+        columns = {'box_image': np.full(len(conf), row), 'xyxy': xyxy, 'conf': conf, 'cls': cls}
+        for name, (dtype, shape) in self.box_columns.items():
+            self._spill[name].write(np.asarray(columns[name], dtype=dtype).reshape((-1,) + shape).tobytes())
+
+    def save(self):
+        # Same layout as np.savez_compressed, the box columns are copied from their spill files
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            def write(name, array):
+                with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+            write('meta', np.array(json.dumps(self.meta)))
+            write('image', np.array(self.images, dtype=str))
+            write('scene', np.array(self.scenes, dtype=str))
+            write('color_score', np.array(self.color_scores, dtype=np.float32))
+            for name, (dtype, shape) in self.box_columns.items():
+                if self._spill is None:
+                    write(name, np.zeros((0,) + shape, dtype=dtype))
+                    continue
+                spill = self._spill[name]
+                count = spill.tell() // (np.dtype(dtype).itemsize * int(np.prod(shape)))
+                with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array_header_2_0(f, {
+                        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                        'fortran_order': False,
+                        'shape': (count,) + shape,
+                    })
+                    spill.seek(0)
+                    shutil.copyfileobj(spill, f, 1 << 20)
+                spill.seek(0, os.SEEK_END)
+
+    def close(self):
+        # Drop the spill files once saved
+        for spill in (self._spill or {}).values():
+            spill.close()
+        self._spill = None
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            store = cls(path, json.loads(str(data['meta'])))
+            store.images = data['image'].tolist()
+            store.scenes = data['scene'].tolist()
+            store.color_scores = data['color_score']
+            store.box_image = data['box_image']
+            store.xyxy = data['xyxy']
+            store.conf = data['conf']
+            store.cls = data['cls']
+        # Boxes are written grouped by image, offsets[row]:offsets[row+1] are the boxes of row
+        store._offsets = np.searchsorted(store.box_image, np.arange(len(store.images) + 1))
+        store._rows = {name: row for row, name in enumerate(store.images)}
+        return store
+
+    @classmethod
+    def merge(cls, path, part_paths, meta):
+        # One store from the per-chunk stores of a distributed run
+        store = cls(path, meta)
+        for part_path in part_paths:
+            part = cls.load(part_path)
+            for filename in part.images:
+                store.add(filename, *part.get(filename))
+        store.save()
+        store.close()
+        return store
+
+    def get(self, filename):
+        # -> (scene, color_score, xyxy, conf, cls) of a loaded store
+        row = self._rows[filename]
+        boxes = slice(self._offsets[row], self._offsets[row + 1])
+        return (self.scenes[row], float(self.color_scores[row]),
+                self.xyxy[boxes].tolist(), self.conf[boxes].tolist(), self.cls[boxes].tolist())
+
+def file_identity(path, content_hash=False, st=None):
+    # What makes a file "the same file" for resuming a run, st: stat already taken by the scanner
+    st = st or os.stat(path)
+    identity = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if content_hash:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        identity["hash"] = h.hexdigest()
+    return identity
+
+class RunManifest():
+    """
+    Append-only JSONL log of finished images so an interrupted or extended run
+    only processes new or changed files. The first line holds the run
+    timestamp and settings, every other line is
+      {"key": filename, "identity": file_identity(), "record": record}
+    Lines are flushed to disk at most checkpoint_interval seconds apart.
+    """
+    def __init__(self, path, settings, checkpoint_interval=5.0):
+        self.path = path
+        # Round trip so comparisons with a loaded header see the same types
+        self.settings = json.loads(json.dumps(settings))
+        self.checkpoint_interval = checkpoint_interval
+        self._f = None
+        self._last_flush = 0.0
+
+    def load(self):
+        # -> (timestamp, {key: entry}) of the last run with the same settings, (None, {}) otherwise
+        if not os.path.isfile(self.path):
+            return None, {}
+        entries = {}
+        with open(self.path) as f:
+            try:
+                header = json.loads(f.readline())
+            except json.JSONDecodeError:
+                return None, {}
+            if header.get("settings") != self.settings:
+                return None, {}
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line from a crash
+                    break
+                entries[entry["key"]] = entry
+        return header["timestamp"], entries
+
+    def open(self, timestamp, append=False):
+        if append:
+            self._f = open(self.path, 'a')
+        else:
+            self._f = open(self.path, 'w')
+            self._f.write(json.dumps({"timestamp": timestamp, "settings": self.settings}) + '\n')
+        self.checkpoint(force=True)
+
+    def add(self, key, identity, record):
+        self._f.write(json.dumps({"key": key, "identity": identity, "record": record}) + '\n')
+        self.checkpoint()
+
+    def checkpoint(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_flush >= self.checkpoint_interval:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._last_flush = now
+
+    def close(self):
+        if self._f is not None:
+            self.checkpoint(force=True)
+            self._f.close()
+            self._f = None
+
+class JsonlSink():
+    def __init__(self, path, append=False):
+        self.f = open(path, 'a' if append else 'w')
+
+    def write(self, record):
+        self.f.write(json.dumps(record) + '\n')
+
+    def add_columns(self, columns):
+        pass
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class CsvSink():
+    def __init__(self, path, columns, append=False):
+        self.path = path
+        fieldnames = list(columns)
+        header = not (append and os.path.isfile(path))
+        if not header:
+            # Keep the columns of the file being appended to
+            with open(path, newline='') as f:
+                fieldnames = next(csv.reader(f), fieldnames)
+        self.f = open(path, 'a' if append else 'w', newline='')
+        self.writer = csv.DictWriter(self.f, fieldnames=fieldnames, extrasaction='ignore')
+        if header:
+            self.writer.writeheader()
+        self.add_columns(columns)
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+    def add_columns(self, columns):
+        # Rewrites the rows so far under the wider header
+        fieldnames = self.writer.fieldnames + [c for c in columns if c not in self.writer.fieldnames]
+        if fieldnames == self.writer.fieldnames:
+            return
+        self.f.close()
+        with open(self.path, newline='') as src, open(self.path + ".tmp", 'w', newline='') as dst:
+            writer = csv.DictWriter(dst, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(csv.DictReader(src))
+        os.replace(self.path + ".tmp", self.path)
+        self.f = open(self.path, 'a', newline='')
+        self.writer = csv.DictWriter(self.f, fieldnames=fieldnames, extrasaction='ignore')
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class ParquetSink():
+    # Rows are buffered and written as one row group per flush, needs pyarrow
+    def __init__(self, path, columns, append=False):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa, self.pq = pa, pq
+        if append and os.path.isfile(path):
+            # Parquet files cannot be appended to, a resumed run writes the next part beside it
+            base, ext = os.path.splitext(path)
+            part = 1
+            while os.path.isfile(f"{base}.part{part}{ext}"):
+                part += 1
+            path = f"{base}.part{part}{ext}"
+        self.types = {str: pa.string(), int: pa.int64(), float: pa.float64()}
+        self.columns = dict(columns)
+        self.schema = pa.schema([(name, self.types[t]) for name, t in self.columns.items()])
+        self.path = path
+        self.rows = []
+        self.writer = None
+
+    def write(self, record):
+        self.rows.append(record)
+
+    def add_columns(self, columns):
+        new = {name: t for name, t in columns.items() if name not in self.columns}
+        if not new:
+            return
+        self.columns.update(new)
+        self.schema = self.pa.schema([(name, self.types[t]) for name, t in self.columns.items()])
+        if self.writer is None:
+            return
+        # Row groups already written are rewritten with the new columns empty
+        self.writer.close()
+        table = self.pq.read_table(self.path)
+        for name, t in new.items():
+            table = table.append_column(name, self.pa.nulls(len(table), self.types[t]))
+        self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table)
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = self.pa.Table.from_pylist([{c: r.get(c) for c in self.columns} for r in self.rows], schema=self.schema)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+class ResultStream():
+    """
+    Appends each finished record to every sink as it completes so results
+    are on disk during the run and memory does not grow with the folder.
+    Sinks are flushed at most flush_interval seconds apart.
+    """
+    def __init__(self, sinks, flush_interval=5.0):
+        self.sinks = sinks
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self.videos = False
+
+    def write(self, record):
+        if "best_frame" in record and not self.videos:
+            # Only folders with clips get the clip columns
+            self.videos = True
+            for sink in self.sinks:
+                sink.add_columns(VIDEO_COLUMNS)
+        for sink in self.sinks:
+            sink.write(record)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+class RunMetrics():
+    """
+    Timers, counters and gauges of one run, safe to update from any thread.
+    A timer keeps the call count, total seconds and a window of the latest
+    latencies for percentiles. progress() is the cheap per image summary
+    for progress_callback, snapshot() everything, for export().
+    """
+    def __init__(self, window=10000):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.window = window
+        self.timers = {}
+        self.latencies = {}
+        self.counters = {}
+        self.gauges = {}
+        self.processed = 0
+        self.total = 0
+
+    @contextlib.contextmanager
+    def time(self, stage, items=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, items)
+
+    def timed(self, stage, fn):
+        def wrapper(*args, **kwargs):
+            with self.time(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def observe(self, stage, seconds, items=1):
+        with self.lock:
+            calls, total, count = self.timers.get(stage, (0, 0.0, 0))
+            self.timers[stage] = (calls + 1, total + seconds, count + items)
+            if stage not in self.latencies:
+                self.latencies[stage] = deque(maxlen=self.window)
+            self.latencies[stage].append(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        # Last value and the highest seen
+        with self.lock:
+            peak = self.gauges.get(name, (0, 0))[1]
+            self.gauges[name] = (value, max(peak, value))
+
+    def progress(self, processed, total):
+        self.processed, self.total = processed, total
+        elapsed = time.perf_counter() - self.start
+        # Images taken over from a resumed run took no time
+        rate = (processed - self.counters.get("resumed", 0)) / elapsed if elapsed > 0 else 0.0
+        return {
+            "processed": processed,
+            "total": total,
+            "elapsed": elapsed,
+            "images_per_sec": rate,
+            # Grows with the total while the input is still being scanned
+            "eta": (total - processed) / rate if rate > 0 else None,
+            "day": self.counters.get("scene_day", 0),
+            "night": self.counters.get("scene_night", 0),
+            "with_animals": self.counters.get("with_animals", 0),
+        }
+
+    def snapshot(self):
+        event = self.progress(self.processed, self.total)
+        with self.lock:
+            latencies = {stage: np.array(window) for stage, window in self.latencies.items()}
+            event["stages"] = {
+                stage: {
+                    "calls": calls,
+                    "items": count,
+                    "seconds": total,
+                    "p50": float(np.percentile(latencies[stage], 50)),
+                    "p90": float(np.percentile(latencies[stage], 90)),
+                    "p99": float(np.percentile(latencies[stage], 99)),
+                }
+                for stage, (calls, total, count) in self.timers.items()
+            }
+            event["counters"] = dict(self.counters)
+            event["queues"] = {name: {"depth": depth, "max": peak} for name, (depth, peak) in self.gauges.items()}
+        return event
+
+    def state(self):
+        # Raw timers, latencies, counters and gauges, picklable for merge() in another process
+        with self.lock:
+            return {
+                "timers": dict(self.timers),
+                "latencies": {stage: list(window) for stage, window in self.latencies.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+    def merge(self, state):
+        # Add the state() of a worker's metrics to these
+        with self.lock:
+            for stage, (calls, total, count) in state["timers"].items():
+                own = self.timers.get(stage, (0, 0.0, 0))
+                self.timers[stage] = (own[0] + calls, own[1] + total, own[2] + count)
+                if stage not in self.latencies:
+                    self.latencies[stage] = deque(maxlen=self.window)
+                self.latencies[stage].extend(state["latencies"].get(stage, ()))
+            for name, n in state["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            # Queues are per worker, keep the deepest
+            for name, (depth, peak) in state["gauges"].items():
+                own = self.gauges.get(name, (0, 0))
+                self.gauges[name] = (max(own[0], depth), max(own[1], peak))
+
+    def prometheus(self, snapshot):
+        lines = []
+        def metric(name, kind, values, help_text):
+            lines.append(f"# HELP wildscan_{name} {help_text}")
+            lines.append(f"# TYPE wildscan_{name} {kind}")
+            for labels, value in values:
+                label = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"wildscan_{name}{{{label}}} {value}" if label else f"wildscan_{name} {value}")
+        metric("images_processed", "counter", [({}, snapshot["processed"])], "Images finished")
+        metric("images_total", "gauge", [({}, snapshot["total"])], "Images found so far")
+        metric("images_per_second", "gauge", [({}, snapshot["images_per_sec"])], "Throughput since the start of the run")
+        metric("eta_seconds", "gauge", [({}, snapshot["eta"] if snapshot["eta"] is not None else "NaN")], "Estimated time left")
+        metric("scene_images", "counter", [({"scene": "day"}, snapshot["day"]), ({"scene": "night"}, snapshot["night"])],
+               "Images per scene")
+        stages = snapshot["stages"]
+        metric("stage_seconds", "counter", [({"stage": s}, v["seconds"]) for s, v in stages.items()], "Time spent per stage")
+        metric("stage_calls", "counter", [({"stage": s}, v["calls"]) for s, v in stages.items()], "Calls per stage")
+        metric("stage_latency_seconds", "summary",
+               [({"stage": s, "quantile": q}, v[key]) for s, v in stages.items()
+                for q, key in (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99"))],
+               "Latency of the latest calls per stage")
+        metric("events", "counter", [({"name": n}, v) for n, v in snapshot["counters"].items()], "Counters")
+        metric("queue_depth", "gauge", [({"queue": n}, v["depth"]) for n, v in snapshot["queues"].items()], "Items waiting")
+        metric("queue_depth_max", "gauge", [({"queue": n}, v["max"]) for n, v in snapshot["queues"].items()], "Most items waiting")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        # Prometheus text format (for a textfile collector) unless path ends in .json.
+        # Written to a temporary file and renamed so readers never see a partial file
+        snapshot = self.snapshot()
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as f:
+            if path.endswith(".json"):
+                json.dump(snapshot, f, indent=4)
+            else:
+                f.write(self.prometheus(snapshot))
+        os.replace(tmp, path)
+
+class RunControl():
+    """
+    Channel between a run and its front end. The run publishes its progress
+    with update(), the front end reads the latest state with poll() at its
+    own pace, or has callback called at most once every interval seconds,
+    so a fast run cannot flood an event loop. cancel(), pause() and resume()
+    work from any thread. A cancelled run stops taking new files, finishes
+    the ones in flight and writes its partial results as usual.
+    The events can be given, e.g. manager events shared with worker processes.
+    """
+    def __init__(self, callback=None, interval=0.1, cancel_event=None, resume_event=None):
+        self.callback = callback
+        self.interval = interval
+        self._cancel = cancel_event or threading.Event()
+        # Set while running, cleared while paused
+        self._resume = resume_event or threading.Event()
+        if resume_event is None:
+            self._resume.set()
+        self._lock = threading.Lock()
+        self._state = None
+        self._version = 0
+        self._sent = 0
+        self._last = 0.0
+
+    def update(self, *state):
+        with self._lock:
+            self._state = state
+            self._version += 1
+            if self.callback is not None and time.monotonic() - self._last >= self.interval:
+                self._last = time.monotonic()
+                self._sent = self._version
+                self.callback(*state)
+
+    def flush(self):
+        # Deliver the last state if the rate limit held it back
+        with self._lock:
+            if self.callback is not None and self._sent != self._version:
+                self._sent = self._version
+                self.callback(*self._state)
+
+    def poll(self):
+        return self._state
+
+    def cancel(self):
+        self._cancel.set()
+        # A paused run has to wake up to stop
+        self._resume.set()
+
+    def pause(self):
+        self._resume.clear()
+
+    def resume(self):
+        self._resume.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def paused(self):
+        return not self._resume.is_set()
+
+    def wait(self):
+        # Called by the run between files: blocks while paused, False once cancelled
+        while not self._resume.wait(0.5):
+            pass
+        return not self._cancel.is_set()
+
+def _copy_file_range(src, dst):
+    # Kernel side copy, the filesystem may share extents (btrfs/XFS reflink, NFS server side copy)
+    if not hasattr(os, "copy_file_range"):
+        return False
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            return False
+    shutil.copystat(src, dst)
+    return remaining == 0
+
+# How unmodified input files are put in the sorted folders
+placements = ("hardlink", "reflink", "copy", "move", "encode")
+
+def place_file(src, dst, strategy="copy"):
+    """
+    Put an unmodified input file at dst without decoding it, keeping its
+    bytes and EXIF. hardlink and reflink fall back to a copy when the
+    filesystem cannot do them. move takes the file out of the input folder.
+    """
+    if os.path.lexists(dst):
+        # Re-sorting into a folder that already has it (resume, rethreshold)
+        os.remove(dst)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if strategy == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif strategy == "reflink":
+        if _copy_file_range(src, dst):
+            return
+    elif strategy == "move":
+        shutil.move(src, dst)
+        return
+    shutil.copy2(src, dst)
+
+# cv2.imwrite parameters per output format, quality applies to jpg/webp
+def encode_params(fmt, quality=95):
+    if fmt in ("jpg", "jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if fmt == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if fmt == "png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, 3]
+    return []
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+# Sorted folders of earlier runs, never scanned as input
+OUTPUT_PREFIXES = ("has_animal_", "no_animal_")
+
+def scan_images(folder, recursive=True, skip=(), extensions=IMAGE_EXTENSIONS):
+    """
+    Yields (relative path, stat) of the images under folder as they are
+    found, so processing starts before a large card dump is fully listed.
+    Depth first with files before subfolders, both in natural order.
+    Hidden folders, earlier runs' sorted folders and the paths in skip
+    are not entered.
+    """
+    skip = {os.path.realpath(path) for path in skip}
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        try:
+            with os.scandir(os.path.join(folder, rel)) as it:
+                entries = sorted(it, key=lambda e: _natural_key(e.name))
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if (recursive and not entry.name.startswith(('.',) + OUTPUT_PREFIXES)
+                            and os.path.realpath(entry.path) not in skip):
+                        subdirs.append(os.path.join(rel, entry.name))
+                elif entry.name.lower().endswith(extensions):
+                    yield os.path.join(rel, entry.name), entry.stat()
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+
+def list_images(folder, recursive=True, skip=(), extensions=IMAGE_EXTENSIONS):
+    return [filename for filename, _ in scan_images(folder, recursive, skip, extensions)]
+
+def sample_video(path, stride=30, keyframes=False):
+    """
+    Yields (frame number, time in ms, BGR frame) for every stride-th frame of
+    a clip. Frames in between are only grabbed, never converted to BGR.
+    keyframes=True decodes nothing but the clip's keyframes instead, needs PyAV.
+    """
+    if keyframes:
+        import av
+        try:
+            container = av.open(path)
+        except (OSError, ValueError):
+            return
+        with container:
+            stream = container.streams.video[0]
+            stream.codec_context.skip_frame = "NONKEY"
+            fps = float(stream.average_rate or 0)
+            try:
+                for frame in container.decode(stream):
+                    seconds = float(frame.time or 0)
+                    yield round(seconds*fps), seconds*1000, frame.to_ndarray(format="bgr24")
+            except (OSError, ValueError):
+                # Truncated clip, keep what was decoded
+                return
+        return
+    cap = cv2.VideoCapture(path)
+    try:
+        stride = max(1, int(stride))
+        index = 0
+        while cap.grab():
+            if index % stride == 0:
+                ok, img = cap.retrieve()
+                if ok:
+                    yield index, cap.get(cv2.CAP_PROP_POS_MSEC), img
+            index += 1
+    finally:
+        cap.release()
+
+# === Autotuning ===
+# Measured settings per machine and model, see app.tune
+PROFILE_CACHE = os.path.join(os.path.expanduser("~"), ".wildscan", "profiles.json")
+
+def machine_info():
+    # Usable cores, total and available RAM in bytes (None when unknown)
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    ram = available = None
+    try:
+        with open("/proc/meminfo") as f:
+            meminfo = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in f}
+        ram, available = meminfo["MemTotal"], meminfo.get("MemAvailable", meminfo["MemFree"])
+    except (OSError, KeyError, ValueError):
+        try:
+            import psutil
+            memory = psutil.virtual_memory()
+            ram, available = memory.total, memory.available
+        except ModuleNotFoundError:
+            pass
+    return {"host": socket.gethostname(), "cores": cores, "ram": ram, "available": available}
+
+def load_profiles(path=PROFILE_CACHE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_profiles(profiles, path=PROFILE_CACHE):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(profiles, f, indent=4)
+    os.replace(tmp, path)
+
+def _limit_worker_threads(workers, cores):
+    # One of workers processes on cores: OpenCV single threaded (the decode
+    # pool is the parallelism), torch inference on this worker's share only,
+    # workers processes with all cores each would oversubscribe the machine
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(max(1, cores // workers))
+    except ImportError:
+        pass
+
+def _shard_worker(runner, filenames, results_q, cancel=None, resume=None):
+    # Child process of app.run_sharded: models load once into this process'
+    # cache, (filename, record) is streamed back to the coordinator.
+    # cancel/resume: manager events the coordinator mirrors its RunControl to
+    _limit_worker_threads(runner.workers, machine_info()["cores"])
+    runner.control = RunControl(cancel_event=cancel, resume_event=resume) if cancel is not None else None
+    # The coordinator counts the records, stage timings are sent back as
+    # (None, metrics state) once the shard is done
+    runner.metrics = RunMetrics()
+    try:
+        runner.process_files(filenames, lambda filename, record: results_q.put((filename, record)))
+    finally:
+        results_q.put((None, runner.metrics.state()))
+
+def _tune_worker(runner, info, sample_size):
+    # Child process of app.tune when workers > 1: measures with the share of
+    # cores one worker gets, the models it loads go away with the process
+    _limit_worker_threads(runner.workers, info["cores"])
+    runner.metrics = RunMetrics()
+    return runner.measure_profile(info, sample_size)
+
 class app():
     def __init__(self,
                  model: str,
@@ -61,27 +1180,169 @@ class app():
                  day_conf: float,
                  night_conf: float,
                  progress_callback=None,
-                 verbose: bool = False):
+                 verbose: bool = False,
+                 batch_size: int = 8,
+                 pipeline: bool = False,
+                 decode_threads: int = 4,
+                 write_threads: int = 2,
+                 queue_depth: int = 32,
+                 device: str = "auto",
+                 backend: str = "pytorch",
+                 workers: int = 1,
+                 store_min_conf: float = 1,
+                 resume: bool = False,
+                 content_hash: bool = False,
+                 checkpoint_interval: float = 5.0,
+                 stream_formats=("csv",),
+                 summary: bool = True,
+                 placement: str = "copy",
+                 image_format: str = None,
+                 jpeg_quality: int = 95,
+                 preview_size: int = 1280,
+                 preview_mode: str = "none",
+                 use_exif: bool = True,
+                 reduced_decode: bool = True,
+                 sequence_policy: str = "off",
+                 event_gap: float = 10.0,
+                 hash_threshold: int = 6,
+                 cascade: bool = False,
+                 screen_imgsz: int = 640,
+                 screen_conf: float = 5,
+                 screen_weights: str = None,
+                 timestamp: str = None,
+                 recursive: bool = True,
+                 videos: bool = True,
+                 video_stride: int = 30,
+                 video_keyframes: bool = False,
+                 progress_detail: bool = False,
+                 metrics_path: str = None,
+                 metrics_interval: float = 10.0,
+                 control: RunControl = None,
+                 autotune: bool = False,
+                 memory_budget: float = 0.5,
+                 tune_cache: str = None,
+                 retune: bool = False):
         self.start_time = time.perf_counter()
-        self.timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        # Names every output of the run, given when several processes/nodes share one run
+        self.timestamp = timestamp or datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         self.verbose = verbose
+        self.model_name = model
         self.model = models_bl_dict[model]
-        self.day_model = YOLO(self.model['day'])
-        self.day_model.to("cuda")
+        # auto/cuda/cpu, backend is pytorch or an exported onnx/openvino runtime
+        self.device = resolve_device(device)
+        self.backend = backend
+        # workers > 1 shards the images over that many processes, each with its own models
+        self.workers = max(1, int(workers))
+        # Boxes below this percent never pass a threshold (the sliders start at 1%) so are not stored
+        self.store_min_conf = store_min_conf/100
         self.day_conf = day_conf/100
-        self.night_model = YOLO(self.model['night'])
-        self.night_model.to("cuda")
         self.night_conf = night_conf/100
         self.IMAGE_DIR = input_path
+        # Also process subfolders (SITE/CAMERA/DCIM/...), outputs mirror the folder structure
+        self.recursive = recursive
         self.output_dir = output_path
         self.output_mode = output_mode
         self.progress_callback = progress_callback
+        # progress_detail: the callback also gets a third argument, the
+        # RunMetrics.progress dict (throughput, ETA, day/night split)
+        self.progress_detail = progress_detail
+        # Metrics are written to metrics_path every metrics_interval seconds
+        # and at the end, as Prometheus text or JSON (.json)
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.metrics = RunMetrics()
+        # Optional RunControl: throttled progress for a front end, cancel and pause
+        self.control = control
+        # autotune picks batch_size, decode/write threads and queue_depth from
+        # timed warm-up batches at the start of main, within memory_budget (share
+        # of the available RAM). The result is cached per machine and model in
+        # tune_cache, retune measures again
+        self.autotune = autotune
+        self.memory_budget = memory_budget
+        self.tune_cache = tune_cache or PROFILE_CACHE
+        self.retune = retune
+        # Number of frames handed to each model per call
+        self.batch_size = max(1, int(batch_size))
+        # Streaming mode: threaded decode -> infer -> threaded write, bounded by queue_depth
+        self.pipeline = pipeline
+        self.decode_threads = decode_threads
+        self.write_threads = write_threads
+        self.queue_depth = queue_depth
+        # hardlink/reflink/copy/move for outputs with unmodified pixels, encode re-writes the decoded image
+        if placement not in placements:
+            raise ValueError(f"Unknown placement {placement}, expected one of {', '.join(placements)}")
+        self.placement = placement
+        # Encoded outputs: format (None keeps the input's), quality, and
+        # previews scaled to preview_size on the long side written
+        # "alongside" the full image (in a previews folder) or "only" instead of it
+        self.image_format = image_format.lower().lstrip('.') if image_format else None
+        self.jpeg_quality = jpeg_quality
+        if preview_mode not in ("none", "alongside", "only"):
+            raise ValueError(f"Unknown preview_mode {preview_mode}, expected none, alongside or only")
+        self.preview_size = preview_size
+        self.preview_mode = preview_mode
+        # Trust greyscale/flash-fired EXIF before measuring colour
+        self.use_exif = use_exif
+        # Decode JPEGs at the smallest scale still >= the model input size
+        self.reduced_decode = reduced_decode
+        # Burst handling: "group" only reports trigger events, "reuse" gives
+        # near duplicate frames their reference frame's detections, "reuse_empty"
+        # only does so when the reference frame had no animal
+        if sequence_policy not in sequence_policies:
+            raise ValueError(f"Unknown sequence_policy {sequence_policy}, expected one of {', '.join(sequence_policies)}")
+        self.sequence_policy = sequence_policy
+        self.event_gap = event_gap
+        self.hash_threshold = hash_threshold
+        # Cascade: a screening pass at screen_imgsz (with screen_weights, or the
+        # scene's own model) and only frames with a box >= screen_conf percent
+        # get the full MODEL_IMGSZ pass, the others count as empty
+        self.cascade = cascade
+        self.screen_imgsz = screen_imgsz
+        self.screen_conf = screen_conf/100
+        self.screen_weights = screen_weights
+        self.report_columns = dict(REPORT_COLUMNS)
+        if sequence_policy != "off":
+            self.report_columns.update(EVENT_COLUMNS)
+        if cascade:
+            self.report_columns.update(CASCADE_COLUMNS)
+        # Clips: every video_stride-th frame (or only keyframes) goes through
+        # the day/night models until a frame has an animal above threshold
+        self.videos = videos
+        self.video_stride = video_stride
+        self.video_keyframes = video_keyframes
+        self.extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS if videos else IMAGE_EXTENSIONS
+        # Every run logs finished images to a manifest, resume=True reuses the
+        # timestamp (and so the output files) and results of the last run with
+        # the same settings and only processes new or changed images
+        self.content_hash = content_hash
+        self.checkpoint_interval = checkpoint_interval
+        # Results always stream to JSONL, plus any of csv/parquet. summary builds
+        # the JSON/XLSX from the stream at the end, see write_summary
+        self.stream_formats = tuple(stream_formats)
+        self.summary = summary
+        # One manifest per input folder, so runs of other cards into the same
+        # output folder neither resume nor overwrite it
+        source = hashlib.blake2b(os.path.abspath(self.IMAGE_DIR).encode(), digest_size=4).hexdigest()
+        self.manifest = RunManifest(os.sep.join([self.output_dir,
+                                                 f".manifest {source} CONF {int(self.day_conf*100)}-{int(self.night_conf*100)} MODEL {model} MODE {self.output_mode}.jsonl"]),
+                                    self.run_settings(), checkpoint_interval)
+        self.previous = {}
+        if resume:
+            timestamp, self.previous = self.manifest.load()
+            if timestamp is not None:
+                self.timestamp = timestamp
+                if self.verbose: print(f"resuming run {timestamp}, {len(self.previous)} images already done")
         self.OUTPUT_JSON = os.sep.join([self.output_dir,
                                         f"results_{self.timestamp} CONF {int(self.day_conf*100)}-{int(self.night_conf*100)} MODEL {model} MODE {self.output_mode}.json"])
         self.OUTPUT_XLSX = os.sep.join([self.output_dir,
                                         f"results_{self.timestamp} CONF {int(self.day_conf*100)}-{int(self.night_conf*100)} MODEL {model} MODE {self.output_mode}.xlsx"])
         self.DETECTED_DIR = os.sep.join([self.output_dir,
                                          f"has_animal_{self.timestamp} CONF {int(self.day_conf*100)}-{int(self.night_conf*100)} MODEL {model} MODE {self.output_mode}"])
+        self.OUTPUT_STREAM = os.sep.join([self.output_dir,
+                                          f"results_{self.timestamp} CONF {int(self.day_conf*100)}-{int(self.night_conf*100)} MODEL {model} MODE {self.output_mode}"])
+        self.OUTPUT_JSONL = self.OUTPUT_STREAM + ".jsonl"
+        self.OUTPUT_DETECTIONS = os.sep.join([self.output_dir,
+                                              f"detections_{self.timestamp} CONF {int(self.day_conf*100)}-{int(self.night_conf*100)} MODEL {model} MODE {self.output_mode}.npz"])
         self.UNDETECTED_DIR = os.sep.join([self.output_dir,
                                            f"no_animal_{self.timestamp} CONF {int(self.day_conf*100)}-{int(self.night_conf*100)} MODEL {model}"])
         for path in [self.output_dir, self.DETECTED_DIR, self.UNDETECTED_DIR]:
@@ -94,15 +1355,104 @@ class app():
                 print(f'creating DIR {p}')
                 os.mkdir(path)
 
+    @property
+    def day_model(self):
+        return get_model(self.model_name, 'day', self.device, self.backend)
+
+    @property
+    def night_model(self):
+        return get_model(self.model_name, 'night', self.device, self.backend)
+
+    def __getstate__(self):
+        # Sent to worker processes without the (GUI bound) callback or resume state
+        state = self.__dict__.copy()
+        for key in ('progress_callback', 'manifest', 'previous', 'metrics', 'control'):
+            state.pop(key, None)
+        return state
+
+    def run_settings(self):
+        # Everything that changes a result, manifests from other settings are not resumed
+        weights = {}
+        for scene, path in self.model.items():
+            try:
+                st = os.stat(path)
+                weights[scene] = [st.st_size, st.st_mtime_ns]
+            except OSError:
+                weights[scene] = None
+        return {
+            # Cards reuse file names (IMG_0001.JPG...), a run only resumes its own input
+            "input_path": os.path.abspath(self.IMAGE_DIR),
+            "recursive": self.recursive,
+            "model": self.model_name,
+            "weights": weights,
+            "day_conf": self.day_conf,
+            "night_conf": self.night_conf,
+            "output_mode": self.output_mode,
+            "store_min_conf": self.store_min_conf,
+            "sequence": [self.sequence_policy, self.event_gap, self.hash_threshold],
+            "cascade": [self.screen_imgsz, self.screen_conf, self.screen_weights] if self.cascade else None,
+        }
+
     def is_night_by_color(self, img, color_thresh=10):
         # img: BGR (OpenCV)
-        b, g, r = cv2.split(img)
-        diff_rg = np.mean(np.abs(r - g))
-        diff_rb = np.mean(np.abs(r - b))
-        diff_gb = np.mean(np.abs(g - b))
-        color_score = (diff_rg + diff_rb + diff_gb) / 3
-        return color_score < color_thresh, color_score
+        score = color_score(img)
+        return score < color_thresh, score
+
+    def classify_scene(self, img, path=None, color_thresh=10):
+        # EXIF fast path, then the colour score of the decoded image
+        if self.use_exif and path is not None and exif_scene(path) == "night":
+            return True, -1.0
+        return self.is_night_by_color(img, color_thresh)
+
+    def scene_model(self, scene):
+        return self.night_model if scene == "night" else self.day_model
+
+    def scene_settings(self, scene):
+        # === (infer_iou, CONF_THRESHOLD) per scene ===
+        if scene == "night":
+            return 0.85, self.night_conf
+        return 0.75, self.day_conf
+
+    def predict(self, model, imgs, infer_iou, imgsz=MODEL_IMGSZ):
+        # === Keep all the box ===
+        with self.metrics.time("inference" if imgsz == MODEL_IMGSZ else "screening", len(imgs)):
+            return model(imgs, conf=0.001, iou=infer_iou, imgsz=imgsz, device=self.device, verbose=False)
 
+    def screen_model(self, scene):
+        if self.screen_weights:
+            return get_model(self.screen_weights, "screen", self.device, self.backend)
+        return self.scene_model(scene)
+
+    def read_frame(self, path):
+        # -> (img, scale) where scale maps img coordinates to the original's, None if unreadable
+        if path.lower().endswith(VIDEO_EXTENSIONS):
+            # Clips are only placed when not run through detect_video
+            return (None, 1.0) if os.path.isfile(path) else None
+        if self.reduced_decode:
+            return read_reduced(path, MODEL_IMGSZ)
+        img = cv2.imread(path)
+        return None if img is None else (img, 1.0)
+
+    def make_det(self, boxes, scene, img, color_score, scale=1.0):
+        # Convert ultralytics boxes to plain lists so results can outlive the model output,
+        # boxes are rescaled to original image coordinates
+        _, CONF_THRESHOLD = self.scene_settings(scene)
+        if boxes is not None and boxes.conf is not None:
+            conf_list = [float(c) for c in boxes.conf.cpu().tolist()]
+            xyxy = [[float(v)*scale for v in b] for b in boxes.xyxy.cpu().tolist()]
+            cls = [int(c) for c in boxes.cls.cpu().tolist()]
+        else:
+            conf_list, xyxy, cls = [], [], []
+        return {
+            "scene": scene,
+            "conf_list": conf_list,
+            "xyxy": xyxy,
+            "cls": cls,
+            "threshold": CONF_THRESHOLD,
+            "color_score": float(color_score),
+            "img": img,
+            "scale": scale,
+        }
 
     def run_detection(self, img_path, day_model, night_model, ):
         img = cv2.imread(img_path)
@@ -112,32 +1462,109 @@ class app():
         is_night, color_score = self.is_night_by_color(img, color_thresh=10)
         if is_night:
             '''self.enhance_contrast_clahe(img)'''
-            img_for_infer = img
             model = night_model
-            infer_iou = 0.85
             scene = "night"
-            CONF_THRESHOLD = self.night_conf
         else:
-            img_for_infer = img
             model = day_model
-            infer_iou = 0.75
             scene = "day"
-            CONF_THRESHOLD = 0.15
-        # === Keep all the box ===
-        out = model(img_for_infer, conf=0.001, iou=infer_iou,verbose=False)[0]
-        boxes = out.boxes
-        # === Get confidence ===
-        if boxes is not None and boxes.conf is not None:
-            conf_list = [float(c) for c in boxes.conf.cpu().tolist()]
-        else:
-            conf_list = []
-        return {
-            "scene": scene,
-            "conf_list": conf_list,
-            "threshold": CONF_THRESHOLD,
-            "img": img,
-            "boxes": boxes
-        }
+        infer_iou, _ = self.scene_settings(scene)
+        out = self.predict(model, img, infer_iou)[0]
+        return self.make_det(out.boxes, scene, img, color_score)
+
+    def infer_batch(self, scene, scene_frames):
+        # scene_frames: list of (key, img, scale, color_score) that share a scene
+        infer_iou, _ = self.scene_settings(scene)
+        imgs = [img for _, img, _, _ in scene_frames]
+        if not self.cascade:
+            outs = self.predict(self.scene_model(scene), imgs, infer_iou)
+            for (key, img, scale, score), out in zip(scene_frames, outs):
+                yield key, self.make_det(out.boxes, scene, img, score, scale)
+            return
+        # === Screening pass, only candidates go on to the full size model ===
+        outs = list(self.predict(self.screen_model(scene), imgs, infer_iou, self.screen_imgsz))
+        passed = [i for i, out in enumerate(outs)
+                  if out.boxes is not None and any(c >= self.screen_conf for c in out.boxes.conf.cpu().tolist())]
+        if passed:
+            full = self.predict(self.scene_model(scene), [imgs[i] for i in passed], infer_iou)
+            for i, out in zip(passed, full):
+                outs[i] = out
+        passed = set(passed)
+        for i, ((key, img, scale, score), out) in enumerate(zip(scene_frames, outs)):
+            # Screening boxes of a rejected frame are not kept, they would count
+            # (and be stored) as detections at screen_imgsz
+            det = self.make_det(out.boxes if i in passed else None, scene, img, score, scale)
+            det["stage"] = "full" if i in passed else "screen"
+            yield key, det
+
+    def infer_stream(self, items):
+        """
+        items: iterable of (key, (img, scale, is_night, color_score)) with None
+        for unreadable files, the scene is classified while decoding (see
+        process_files). Frames are split into day and night queues and each queue is sent to its
+        model once it holds batch_size frames. Yields (key, det) in completion
+        order, det is None when the image could not be read.
+        """
+        queues = {"day": [], "night": []}
+        for key, frame in items:
+            if frame is None:
+                yield key, None
+                continue
+            img, scale, is_night, score = frame
+            scene = "night" if is_night else "day"
+            queues[scene].append((key, img, scale, score))
+            if len(queues[scene]) >= self.batch_size:
+                yield from self.infer_batch(scene, queues[scene])
+                queues[scene] = []
+        for scene, scene_frames in queues.items():
+            if scene_frames:
+                yield from self.infer_batch(scene, scene_frames)
+
+    def detect_video(self, path):
+        """
+        Run the sampled frames of a clip through the day/night models,
+        batch_size frames per call, and stop decoding after the first batch
+        with an animal above threshold. Returns the det of the frame with the
+        highest confidence, with its frame number and time, None if no frame
+        could be read.
+        """
+        best = None
+        checked = 0
+        batch = []
+        def flush():
+            nonlocal best, checked
+            queues = {"day": [], "night": []}
+            for index, msec, img in batch:
+                is_night, score = self.is_night_by_color(img, color_thresh=10)
+                queues["night" if is_night else "day"].append(((index, msec), img, 1.0, score))
+            batch.clear()
+            for scene, scene_frames in queues.items():
+                if not scene_frames:
+                    continue
+                for (index, msec), det in self.infer_batch(scene, scene_frames):
+                    checked += 1
+                    if best is None or max(det["conf_list"], default=0.0) > max(best["conf_list"], default=0.0):
+                        det["frame"], det["time"] = index, msec/1000
+                        best = det
+            return best is not None and any(c > best["threshold"] for c in best["conf_list"])
+
+        frames = sample_video(path, self.video_stride, self.video_keyframes)
+        while True:
+            with self.metrics.time("video_decode"):
+                frame = next(frames, None)
+            if frame is None:
+                break
+            batch.append(frame)
+            if len(batch) >= self.batch_size and flush():
+                if self.verbose: print(f"{path}: animal at {best['time']:.1f}s, stopped after {checked} frames")
+                frames.close()
+                break
+        if batch:
+            flush()
+        if best is None:
+            return None
+        best["video"] = True
+        best["frames_checked"] = checked
+        return best
 
     def enhance_contrast_clahe(self, img):
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -151,91 +1578,680 @@ class app():
         enhanced_bgr = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR)
         return enhanced_bgr
 
-    def write_image(self, opath, det):
+    def annotate(self, img, boxes, max_side=None, img_scale=1.0):
+        # Draw boxes (original coordinates) on img, first scaled down so its long
+        # side is at most max_side. img_scale: original px per img px
+        scale = 1.0 / img_scale
+        if max_side and max(img.shape[:2]) > max_side:
+            shrink = max_side / max(img.shape[:2])
+            img = cv2.resize(img, None, fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+            scale *= shrink
+        elif boxes and self.preview_mode == "alongside":
+            # Keep the decoded image untouched for the preview
+            img = img.copy()
+        for index, j in enumerate(boxes):
+            conf, box = j
+            conf = format(conf*100,'.0f') + '%'
+            tl, tr, bl, br = (int(v*scale) for v in box)
+            # This will fail if there are more than 20 animals
+            cv2.rectangle(img, (tl,tr), (bl,br), colour[index], max(1, round(2*scale)))
+            cv2.putText(img, str(conf), (tl, tr-int(10*scale)), cv2.FONT_HERSHEY_SIMPLEX, max(0.5, 2.5*scale), colour[index], max(1, round(2*scale)))
+        return img
+
+    def encode(self, opath, img):
+        fmt = self.image_format or os.path.splitext(opath)[1].lower().lstrip('.')
+        if self.image_format:
+            opath = os.path.splitext(opath)[0] + '.' + fmt
+        os.makedirs(os.path.dirname(opath), exist_ok=True)
+        with self.metrics.time("encode"):
+            ok, buf = cv2.imencode('.' + fmt, img, encode_params(fmt, self.jpeg_quality))
+        if not ok:
+            raise ValueError(f"Could not encode {opath} as {fmt}")
+        with self.metrics.time("write"):
+            buf.tofile(opath)
+        self.metrics.count("bytes_written", buf.nbytes)
+
+    def write_image(self, opath, det, ipath=None):
         animal_count = sum(c > det['threshold'] for c in det['conf_list'])
-        boxes = [[det['conf_list'][i], det['boxes'][i]] for i, j in enumerate(det['conf_list']) if j > det['threshold']]
+        boxes = [[det['conf_list'][i], det['xyxy'][i]] for i, j in enumerate(det['conf_list']) if j > det['threshold']]
         img = det['img']
         try:
             assert animal_count < 20
         except AssertionError:
             animal_count = 0
             if self.verbose: print(f"{opath.split(os.sep)[0]} contains too many animals {animal_count} likely error")
-        if self.output_mode == 'Original images' or animal_count == 0:
-            cv2.imwrite(opath, img)
-            #shutil.copy(ipath, opath)
-        elif self.output_mode == 'Annotated images':
-            for index, j in enumerate(boxes):
-                conf, box = j
-                conf = format(conf*100,'.0f') + '%'
-                tl, tr, bl, br = map(int, box.xyxy[0])
-                # This will fail if there are more than 20 animals
-                cv2.rectangle(img, (tl,tr), (bl,br), colour[index], 2)
-                cv2.putText(img, str(conf), (tl, tr-10), cv2.FONT_HERSHEY_SIMPLEX, 2.5, colour[index], 2)
-            cv2.imwrite(opath, img)
+        if self.output_mode != 'Annotated images' or animal_count == 0:
+            boxes = []
+        if det.get("video"):
+            # Clips are sorted as they are (they cannot be encoded), in Annotated
+            # mode with the annotated best frame beside them
+            self.place(ipath, opath, "copy" if self.placement == "encode" else self.placement)
+            if boxes and det['img'] is not None:
+                self.encode(os.path.splitext(opath)[0] + "_best.jpg", self.annotate(det['img'], boxes, self.preview_size))
+            return
+        place = not boxes and ipath is not None and self.placement != "encode"
+        img_scale = det.get('scale', 1.0)
+        if self.preview_mode != "only" and not place and img_scale != 1.0:
+            # Full size output but only a reduced decode in hand
+            img = None
+        if img is None and not (place and self.preview_mode == "none"):
+            with self.metrics.time("decode"):
+                img, img_scale = cv2.imread(ipath), 1.0
+        if self.preview_mode != "only":
+            if place:
+                self.place(ipath, opath, self.placement)
+            else:
+                with self.metrics.time("annotate"):
+                    img_out = self.annotate(img, boxes, img_scale=img_scale)
+                self.encode(opath, img_out)
+        if self.preview_mode != "none":
+            folder, name = os.path.split(opath)
+            ppath = opath if self.preview_mode == "only" else os.path.join(folder, "previews", name)
+            with self.metrics.time("annotate"):
+                img_out = self.annotate(img, boxes, self.preview_size, img_scale)
+            self.encode(ppath, img_out)
+
+    def place(self, ipath, opath, strategy):
+        with self.metrics.time("place"):
+            place_file(ipath, opath, strategy)
+        if strategy in ("copy", "reflink"):
+            self.metrics.count("bytes_written", os.path.getsize(opath))
+
+    def handle_detection(self, filename, det):
+        conf_list = det["conf_list"]
+        scene = det["scene"]
+        CONF_THRESHOLD = det["threshold"]
+        animal_count = sum(c > CONF_THRESHOLD for c in conf_list)
+        max_conf = max(conf_list) if conf_list else 0.0
+        if animal_count > 0:
+            opath = os.path.join(self.DETECTED_DIR, filename)
+            if self.verbose: print(f"{filename} contains animals")
+        else:
+            opath = os.path.join(self.UNDETECTED_DIR, filename)
+            if self.verbose: print(f"{filename} does not contain animals")
+        kept = [i for i, c in enumerate(conf_list) if c >= self.store_min_conf]
+        record = {
+            "image_name": filename,
+            "scene": scene,
+            "animals_detected": int(animal_count),
+            "max_confidence": max_conf,
+            # Raw boxes for the detections store, not part of the report
+            "detections": {
+                "color_score": det["color_score"],
+                "xyxy": [det["xyxy"][i] for i in kept],
+                "conf": [conf_list[i] for i in kept],
+                "cls": [det["cls"][i] for i in kept],
+            }
+        }
+        if "stage" in det:
+            record["stage"] = det["stage"]
+        if "frame" in det:
+            record["best_frame"] = det["frame"]
+            record["best_time"] = det["time"]
+            record["frames_checked"] = det["frames_checked"]
+        return opath, record
+
+    def det_from_store(self, store, filename, img, scale=1.0):
+        # Rebuild run_detection's output from stored boxes with this app's thresholds
+        scene, color_score, xyxy, conf_list, cls = store.get(filename)
+        _, CONF_THRESHOLD = self.scene_settings(scene)
+        return {
+            "scene": scene,
+            "conf_list": conf_list,
+            "xyxy": xyxy,
+            "cls": cls,
+            "threshold": CONF_THRESHOLD,
+            "color_score": color_score,
+            "img": img,
+            "scale": scale,
+            "video": filename.lower().endswith(VIDEO_EXTENSIONS),
+        }
+
+    def process_files(self, images, on_record, detect=None, read=None):
+        """
+        Decode, infer and write the given filenames from IMAGE_DIR.
+        on_record(filename, record) is called once per file as its output is
+        written, record is None if the image could not be read.
+        detect replaces infer_stream, it maps (filename, frame) pairs to (filename, det).
+        read(path) -> frame, read_frame by default.
+        """
+        read = self.metrics.timed("decode", read or self.read_frame)
+        if detect is None:
+            # EXIF read and colour score on the decode threads, off the inference thread
+            decode = read
+            def read(path):
+                frame = decode(path)
+                if frame is None:
+                    return None
+                with self.metrics.time("scene"):
+                    is_night, score = self.classify_scene(frame[0], path, color_thresh=10)
+                return frame + (is_night, score)
+        videos = []
+        def split():
+            # Clips need the models while decoding, they run after the images
+            for filename in images:
+                if self.control is not None and not self.control.wait():
+                    return
+                if detect is None and filename.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.append(filename)
+                else:
+                    yield filename
+        paths = ((filename, os.sep.join([self.IMAGE_DIR, filename])) for filename in split())
+        if self.pipeline:
+            decoded = prefetch(paths, read, self.decode_threads, self.queue_depth,
+                               lambda n: self.metrics.gauge("decode_queue", n))
+        else:
+            decoded = ((filename, read(path)) for filename, path in paths)
+        # Writes and file placement always run on the I/O pool so they overlap inference
+        # A file whose output could not be written is reported like an unreadable one,
+        # so it is not logged as done and a resumed run writes it again
+        writer = ImageWriter(self.write_image, self.write_threads, self.queue_depth, on_record,
+                             lambda filename, record: on_record(filename, None))
+        try:
+            for filename, det in (detect or self.infer_stream)(decoded):
+                if det is None:
+                    writer.done(filename, None)
+                    continue
+                opath, record = self.handle_detection(filename, det)
+                ipath = os.sep.join([self.IMAGE_DIR, filename])
+                writer.submit((opath, det, ipath), (filename, record))
+                self.metrics.gauge("write_queue", writer.pending)
+            for filename in videos:
+                if self.control is not None and not self.control.wait():
+                    break
+                ipath = os.sep.join([self.IMAGE_DIR, filename])
+                det = self.detect_video(ipath)
+                if det is None:
+                    writer.done(filename, None)
+                    continue
+                opath, record = self.handle_detection(filename, det)
+                writer.submit((opath, det, ipath), (filename, record))
+        finally:
+            writer.close()
+
+    def run_sharded(self, images, on_record):
+        """
+        Split images over self.workers processes. Every worker loads its own
+        models and writes into the shared output folders, records come back
+        over a queue so on_record still sees every image as it finishes.
+        """
+        shards = [images[i::self.workers] for i in range(self.workers)]
+        shards = [shard for shard in shards if shard]
+        if self.backend != "pytorch":
+            # Export here once, the workers would all export the same weights at the same time
+            weights = set(self.model.values())
+            if self.cascade and self.screen_weights:
+                weights.add(self.screen_weights)
+            for path in sorted(weights):
+                export_model(path, self.backend)
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Manager() as manager:
+            results_q = manager.Queue()
+            cancel = resume = None
+            if self.control is not None:
+                cancel, resume = manager.Event(), manager.Event()
+                resume.set()
+            relayed = (False, False)
+            with ProcessPoolExecutor(max_workers=len(shards) or 1, mp_context=ctx) as pool:
+                futures = [pool.submit(_shard_worker, self, shard, results_q, cancel, resume) for shard in shards]
+                remaining = len(images)
+                reporting = len(futures)
+                while remaining or reporting:
+                    if self.control is not None and (self.control.cancelled, self.control.paused) != relayed:
+                        relayed = (self.control.cancelled, self.control.paused)
+                        if relayed[0]:
+                            cancel.set()
+                        if relayed[1] and not relayed[0]:
+                            resume.clear()
+                        else:
+                            resume.set()
+                    try:
+                        filename, record = results_q.get(timeout=0.5)
+                    except queue.Empty:
+                        # Surface a crashed worker instead of waiting forever
+                        for fut in futures:
+                            if fut.done() and fut.exception() is not None:
+                                raise fut.exception()
+                        if all(fut.done() for fut in futures) and results_q.empty():
+                            # Cancelled, the workers stopped early
+                            break
+                        continue
+                    if filename is None:
+                        self.metrics.merge(record)
+                        reporting -= 1
+                        continue
+                    on_record(filename, record)
+                    remaining -= 1
+                for fut in futures:
+                    fut.result()
+
+    def dispatch(self, images, on_record, detect=None, read=None):
+        if self.workers > 1 and detect is None:
+            self.run_sharded(images, on_record)
+        else:
+            self.process_files(images, on_record, detect, read)
+
+    def run_sequences(self, images, events, on_record, done):
+        """
+        Infer the reference frame of every near duplicate group first, then
+        give duplicates their reference's detections ("reuse"), or only when
+        the reference was empty ("reuse_empty", the rest is inferred last).
+        done: records of a resumed run, references may be among them.
+        """
+        refs = {events[f][2] for f in images if events[f][2] is not None}
+        known = {}
+        for filename in refs & done.keys():
+            known[filename] = (done[filename]["scene"], done[filename]["detections"], done[filename]["animals_detected"])
+        def capture(filename, record):
+            if record is not None and filename in refs:
+                known[filename] = (record["scene"], record["detections"], record["animals_detected"])
+            on_record(filename, record)
+
+        todo = set(images)
+        # References, and duplicates whose reference is neither done nor queued (unreadable)
+        first = [f for f in images if events[f][2] is None or events[f][2] not in known and events[f][2] not in todo]
+        self.dispatch(first, capture)
+
+        reuse, infer = [], []
+        first = set(first)
+        for filename in images:
+            if filename in first:
+                continue
+            ref = events[filename][2]
+            if ref in known and (self.sequence_policy == "reuse" or known[ref][2] == 0):
+                reuse.append(filename)
+            else:
+                infer.append(filename)
+
+        def detect(decoded):
+            for filename, frame in decoded:
+                if frame is None:
+                    yield filename, None
+                    continue
+                scene, raw, _ = known[events[filename][2]]
+                _, CONF_THRESHOLD = self.scene_settings(scene)
+                yield filename, {
+                    "scene": scene,
+                    "conf_list": raw["conf"],
+                    "xyxy": raw["xyxy"],
+                    "cls": raw["cls"],
+                    "threshold": CONF_THRESHOLD,
+                    "color_score": raw["color_score"],
+                    "img": frame[0],
+                    "scale": frame[1],
+                }
+        def reused(filename, record):
+            if record is not None:
+                record["reused_from"] = events[filename][2]
+            on_record(filename, record)
+        if self.output_mode == 'Annotated images' or self.placement == "encode" or self.preview_mode != "none":
+            read = self.read_frame
+        else:
+            read = lambda path: (None, 1.0) if os.path.isfile(path) else None
+        if self.verbose: print(f"{len(reuse)} near duplicate frames reuse detections, {len(infer)} inferred")
+        self.process_files(reuse, reused, detect, read)
+        self.dispatch(infer, on_record)
+
+    def tune(self, sample_size=16):
+        """
+        Set batch_size, decode_threads, write_threads and queue_depth (and
+        pipeline) for this machine, model and device, measured once on
+        sample images of IMAGE_DIR and then read from tune_cache.
+        """
+        info = machine_info()
+        key = json.dumps([info["host"], info["cores"], round((info["ram"] or 0) / 2**30), self.workers,
+                          self.device, self.backend, self.model_name, self.run_settings()["weights"],
+                          self.output_mode, self.placement, self.preview_mode])
+        profiles = load_profiles(self.tune_cache)
+        profile = None if self.retune else profiles.get(key)
+        if profile is None:
+            if self.workers > 1:
+                # Measured in a process like one of the workers, the coordinator never loads a model
+                ctx = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    profile = pool.submit(_tune_worker, self, info, sample_size).result()
+            else:
+                profile = self.measure_profile(info, sample_size)
+            if profile is None:
+                return None
+            profiles[key] = profile
+            try:
+                save_profiles(profiles, self.tune_cache)
+            except OSError as e:
+                if self.verbose: print(f"could not save tuning profile: {e}")
+        elif self.verbose:
+            print(f"using tuning profile from {profile['tuned']}")
+        self.batch_size = profile["batch_size"]
+        self.decode_threads = profile["decode_threads"]
+        self.write_threads = profile["write_threads"]
+        self.queue_depth = profile["queue_depth"]
+        self.pipeline = True
+        if self.verbose: print(f"tuned: batch {self.batch_size}, {self.decode_threads} decode threads, "
+                               f"{self.write_threads} write threads, queue {self.queue_depth}")
+        return profile
+
+    def measure_profile(self, info, sample_size=16):
+        """
+        Time decode, inference at growing batch sizes and output writing on
+        up to sample_size images. The batch size grows while throughput
+        still improves by 5% and the batch fits memory_budget, thread counts
+        are what keeps inference fed on the cores of one worker.
+        """
+        samples = []
+        decode_times = []
+        for filename, _ in scan_images(self.IMAGE_DIR, self.recursive, [self.output_dir]):
+            path = os.sep.join([self.IMAGE_DIR, filename])
+            start = time.perf_counter()
+            frame = self.read_frame(path)
+            if frame is not None:
+                decode_times.append(time.perf_counter() - start)
+                samples.append((path, frame[0]))
+            if len(samples) >= sample_size:
+                break
+        if not samples:
+            return None
+        frames = [img for _, img in samples]
+        frame_bytes = sum(img.nbytes for img in frames) / len(frames)
+        scenes = ["night" if self.is_night_by_color(img)[0] else "day" for img in frames]
+        scene = max(set(scenes), key=scenes.count)
+        model = self.scene_model(scene)
+        infer_iou, _ = self.scene_settings(scene)
+        budget = self.memory_budget * (info["available"] or 4 * 2**30)
+        gpu_total = None
+        if self.device.startswith("cuda"):
+            import torch
+            gpu_total = torch.cuda.get_device_properties(self.device).total_memory
+        # Model load and first call setup are not part of the measurement
+        self.predict(model, frames[:1], infer_iou)
+
+        best_rate, best_size = 0.0, 1
+        for size in (1, 2, 4, 8, 16, 32, 64):
+            # Decoded frames plus the letterboxed float input and activations, roughly
+            if size > 1 and size * frame_bytes * 8 > budget:
+                break
+            batch = [frames[i % len(frames)] for i in range(size)]
+            if gpu_total:
+                torch.cuda.reset_peak_memory_stats(self.device)
+            self.predict(model, batch, infer_iou)
+            reps = max(2, sample_size // size)
+            start = time.perf_counter()
+            for _ in range(reps):
+                self.predict(model, batch, infer_iou)
+            rate = size * reps / (time.perf_counter() - start)
+            if gpu_total and torch.cuda.max_memory_allocated(self.device) > self.memory_budget * gpu_total:
+                break
+            if self.verbose: print(f"batch {size}: {rate:.1f} images/s")
+            if rate < best_rate * 1.05:
+                break
+            best_rate, best_size = rate, size
+
+        # Output cost per image: encoding when the pixels change, else placing the file
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            for path, img in samples[:4]:
+                if self.output_mode == 'Annotated images' or self.placement == "encode":
+                    cv2.imencode('.jpg', img, encode_params("jpg", self.jpeg_quality))
+                else:
+                    place_file(path, os.path.join(tmp, os.path.basename(path)), self.placement if self.placement != "move" else "copy")
+            write = (time.perf_counter() - start) / len(samples[:4])
+
+        decode = sorted(decode_times)[len(decode_times) // 2]
+        infer = 1 / best_rate
+        # Cores of one worker process, one stays with the inference loop
+        cores = max(1, info["cores"] // self.workers)
+        decode_threads = min(max(1, math.ceil(decode / infer)), max(1, cores - 1))
+        write_threads = min(max(1, math.ceil(write / infer)), max(1, cores // 2))
+        # Room for two batches in flight, capped to a quarter of the budget
+        queue_depth = max(8, 2 * best_size + decode_threads)
+        queue_depth = int(max(best_size, min(queue_depth, budget / 4 / frame_bytes)))
+        return {
+            "batch_size": best_size,
+            "decode_threads": decode_threads,
+            "write_threads": write_threads,
+            "queue_depth": queue_depth,
+            "images_per_sec": round(best_rate, 2),
+            "decode_ms": round(decode * 1000, 2),
+            "write_ms": round(write * 1000, 2),
+            "machine": info,
+            "tuned": datetime.now().isoformat(timespec="seconds"),
+        }
 
     def main(self):
-        results = []
-        json_results = {}
         if self.verbose: print("\nStart detecting images...\n")
-        images = [i for i in os.listdir(self.IMAGE_DIR) if i.lower().endswith((".jpg", ".jpeg", ".png"))]
-        total = len(images)
-        cbstatus = self.progress_callback is not None
-        counts = {'has animals':0, 'no animals':0}
-        #if self.verbose:
-        print(f"callback is {self.progress_callback}")
-        for index, filename in enumerate(images):
-            path = os.sep.join([self.IMAGE_DIR, filename])
+        if self.autotune:
+            self.tune()
+        stats = {}
+        def scan():
+            for filename, st in scan_images(self.IMAGE_DIR, self.recursive, [self.output_dir], self.extensions):
+                stats[filename] = st
+                yield filename
+        return self.run(scan(), stats=stats)
 
-            det = self.run_detection(path, self.day_model, self.night_model)
-            if det is None:
-                continue
+    def use_part_files(self, prefix):
+        # Chunk of a distributed run: results go to per-chunk files, images still to the shared folders
+        self.OUTPUT_STREAM = prefix
+        self.OUTPUT_JSONL = prefix + ".jsonl"
+        self.OUTPUT_DETECTIONS = prefix + ".npz"
+        self.manifest = RunManifest(prefix + ".manifest.jsonl", self.run_settings(), self.checkpoint_interval)
+        self.previous = {}
+        self.summary = False
 
-            conf_list = det["conf_list"]
-            scene = det["scene"]
-            CONF_THRESHOLD = det["threshold"]
-            boxes = det["boxes"]
-            animal_count = sum(c > CONF_THRESHOLD for c in conf_list)
-            max_conf = max(conf_list) if conf_list else 0.0
-            if animal_count > 0:
-                self.write_image(os.path.join(self.DETECTED_DIR, filename), det)
-                counts['has animals'] += 1
-                if self.verbose: print(f"{filename} does not contain animals")
+    def rethreshold(self, store_path):
+        """
+        Re-sort (and re-annotate) the images of an earlier run from its
+        detections store using this app's thresholds and output mode.
+        No model is loaded.
+        """
+        store = DetectionStore.load(store_path)
+        if self.output_mode == 'Annotated images' or self.placement == "encode" or self.preview_mode != "none":
+            read = self.read_frame
+        else:
+            # Only placing files, write_image never needs the pixels
+            read = lambda path: (None, 1.0) if os.path.isfile(path) else None
+        def detect(decoded):
+            for filename, frame in decoded:
+                yield filename, None if frame is None else self.det_from_store(store, filename, *frame)
+        return self.run(store.images, detect, read)
+
+    def open_stream(self, append=False):
+        sinks = [JsonlSink(self.OUTPUT_JSONL, append)]
+        for fmt in self.stream_formats:
+            if fmt == "csv":
+                sinks.append(CsvSink(self.OUTPUT_STREAM + ".csv", self.report_columns, append))
+            elif fmt == "parquet":
+                sinks.append(ParquetSink(self.OUTPUT_STREAM + ".parquet", self.report_columns, append))
             else:
-                self.write_image(os.path.join(self.UNDETECTED_DIR, filename), det)
-                counts['no animals'] += 1
-                if self.verbose: print(f"{filename} does not contain animals")
-                if self.verbose: print(f"{filename} contains animals")
-            if cbstatus:
-                self.progress_callback(index+1, total)
-
-            # === JSON ===
-            json_results[filename] = {
-                "scene": scene,
-                "animals_above_threshold": int(animal_count),
-                "max_confidence": max_conf
-            }
+                raise ValueError(f"Unknown stream format {fmt}, expected csv or parquet")
+        return ResultStream(sinks, self.checkpoint_interval)
+
+    def write_summary(self):
+        """
+        Build the JSON and XLSX report from the JSONL stream. A file that was
+        written more than once (reprocessed on resume) keeps its last record.
+        """
+        rows = {}
+        with open(self.OUTPUT_JSONL) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line from a crash
+                    continue
+                rows[record["image_name"]] = record
+        names = sorted(rows, key=_natural_key)
+        columns = dict(self.report_columns)
+        if any("best_frame" in row for row in rows.values()):
+            columns.update(VIDEO_COLUMNS)
 
-            results.append([
-                filename,
-                scene,
-                int(animal_count),
-                max_conf
-            ])
         # JSON file
+        json_results = {}
+        for filename in names:
+            json_results[filename] = {("animals_above_threshold" if k == "animals_detected" else k): v
+                                      for k, v in rows[filename].items() if k != "image_name"}
         with open(self.OUTPUT_JSON, "w") as f:
             json.dump(json_results, f, indent=4)
 
         df = pd.DataFrame(
-            results,
-            columns=["image_name", "scene", "animals_detected", "max_confidence"]
+            [[rows[filename].get(c) for c in columns] for filename in names],
+            columns=list(columns)
         )
+        if self.sequence_policy == "off":
+            df.to_excel(self.OUTPUT_XLSX, index=False)
+            return
+        # One row per trigger event next to the per image sheet
+        events = df.groupby("event_id").agg(
+            first_image=("image_name", "first"),
+            last_image=("image_name", "last"),
+            frames=("image_name", "count"),
+            frames_with_animals=("animals_detected", lambda c: int((c > 0).sum())),
+            max_animals=("animals_detected", "max"),
+            max_confidence=("max_confidence", "max"),
+            reused_frames=("reused_from", "count"),
+        ).reset_index()
+        with pd.ExcelWriter(self.OUTPUT_XLSX) as writer:
+            df.to_excel(writer, sheet_name="images", index=False)
+            events.to_excel(writer, sheet_name="events", index=False)
+
+    def run(self, images, detect=None, read=None, stats=None, plan_events=None):
+        """
+        images: list of filenames relative to IMAGE_DIR, or an iterator of them
+        that is consumed while the run goes on (the progress total grows as
+        it is read). stats: os.stat results of the filenames, filled by the
+        iterator. Burst events and sharding need the full list up front.
+        plan_events: {filename: (event_id, event_size, reference)} grouped
+        beforehand over a larger listing (a distributed run's plan).
+        """
+        streaming = not isinstance(images, list)
+        if streaming and (self.sequence_policy != "off" and detect is None or self.workers > 1 and detect is None):
+            images = list(images)
+            streaming = False
+        total = 0 if streaming else len(images)
+        self.metrics = RunMetrics()
+
+        # === Trigger events ===
+        events = {}
+        if self.sequence_policy != "off" and detect is None and plan_events is not None:
+            events = {filename: tuple(plan_events[filename]) for filename in images}
+        elif self.sequence_policy != "off" and detect is None:
+            grouped = group_events([os.sep.join([self.IMAGE_DIR, f]) for f in images],
+                                   self.event_gap, self.hash_threshold, self.decode_threads, self.use_exif)
+            for filename, (event_id, event_size, ref) in zip(images, grouped):
+                events[filename] = (event_id, event_size, None if ref is None else images[ref])
+        cbstatus = self.progress_callback is not None
+        counts = {'has animals':0, 'no animals':0}
+        #if self.verbose:
+        print(f"callback is {self.progress_callback}")
+
+        store = DetectionStore(self.OUTPUT_DETECTIONS, {
+            "input_path": os.path.abspath(self.IMAGE_DIR),
+            "model": self.model_name,
+            "day_conf": self.day_conf,
+            "night_conf": self.night_conf,
+            "output_mode": self.output_mode,
+            "timestamp": self.timestamp,
+        })
+        stream = self.open_stream(append=bool(self.previous))
+        processed = 0
+        lock = threading.Lock()
+        def on_record(filename, record, log=True):
+            # Called from writer threads, or the coordinator when sharded
+            nonlocal processed
+            with lock:
+                processed += 1
+                # Only needed until the record is logged
+                identity = identities.pop(filename, None)
+                if not log:
+                    self.metrics.count("resumed")
+                if record is not None:
+                    self.metrics.count("scene_" + record["scene"])
+                    if record["animals_detected"] > 0:
+                        self.metrics.count("with_animals")
+                    if filename in events:
+                        record["event_id"], record["event_size"] = events[filename][:2]
+                    if log:
+                        self.manifest.add(filename, identity, record)
+                    raw = record["detections"]
+                    store.add(filename, record["scene"], raw["color_score"], raw["xyxy"], raw["conf"], raw["cls"])
+                    if log:
+                        stream.write({k: v for k, v in record.items() if k != "detections"})
+                    counts['has animals' if record["animals_detected"] > 0 else 'no animals'] += 1
+                if cbstatus and self.progress_detail:
+                    self.progress_callback(processed, total, self.metrics.progress(processed, total))
+                elif cbstatus:
+                    self.progress_callback(processed, total)
+                if self.control is not None:
+                    self.control.update(processed, total, self.metrics.progress(processed, total))
+                elif not cbstatus:
+                    self.metrics.processed, self.metrics.total = processed, total
 
-        df.to_excel(self.OUTPUT_XLSX, index=False)
-        has_animal_percentage = format((counts['has animals']/total)*100, '.0f')
-        no_animal_percentage = format((counts['no animals']/total)*100, '.0f')
+        # === Skip images finished by the run being resumed ===
+        identities = {}
+        # Resumed records of burst references, run_sequences reuses their boxes
+        refs = {event[2] for event in events.values() if event[2] is not None}
+        done = {}
+        def pending():
+            nonlocal total
+            for filename in images:
+                if streaming:
+                    total += 1
+                st = stats.pop(filename, None) if stats is not None else None
+                try:
+                    identities[filename] = file_identity(os.sep.join([self.IMAGE_DIR, filename]), self.content_hash, st)
+                except OSError:
+                    identities[filename] = None
+                entry = self.previous.get(filename)
+                if entry is not None and entry["identity"] == identities[filename]:
+                    if filename in refs:
+                        done[filename] = entry["record"]
+                    on_record(filename, entry["record"], log=False)
+                    continue
+                if entry is not None:
+                    # Changed since the last run, drop its old sorted copy
+                    for folder in (self.DETECTED_DIR, self.UNDETECTED_DIR):
+                        stale = os.path.join(folder, filename)
+                        if os.path.isfile(stale):
+                            os.remove(stale)
+                yield filename
+
+        stop_export = threading.Event()
+        def export():
+            while not stop_export.wait(self.metrics_interval):
+                try:
+                    self.metrics.export(self.metrics_path)
+                except OSError as e:
+                    if self.verbose: print(f"could not write metrics: {e}")
+        if self.metrics_path:
+            threading.Thread(target=export, daemon=True).start()
+
+        self.manifest.open(self.timestamp, append=bool(self.previous))
+        try:
+            todo = pending() if streaming else list(pending())
+            if events and self.sequence_policy != "group":
+                self.run_sequences(todo, events, on_record, done)
+            else:
+                self.dispatch(todo, on_record, detect, read)
+        finally:
+            stop_export.set()
+            stream.close()
+            self.manifest.close()
+        store.save()
+        store.close()
+        if self.summary:
+            with self.metrics.time("report"):
+                self.write_summary()
+        if self.metrics_path:
+            self.metrics.export(self.metrics_path)
+        if self.control is not None:
+            self.control.flush()
+
+        has_animal_percentage = format((counts['has animals']/max(total, 1))*100, '.0f')
+        no_animal_percentage = format((counts['no animals']/max(total, 1))*100, '.0f')
         duration = format(time.perf_counter() - self.start_time, '.0f')
-        message = f"""Completed in {duration} seconds
-Wrote JSON, Excel Spreadsheet and Sorted images
+        status = "Completed"
+        if self.control is not None and self.control.cancelled:
+            status = f"Stopped after {processed} of {total} images found, partial results written\nCancelled"
+        message = f"""{status} in {duration} seconds
+Wrote {"JSON, Excel Spreadsheet, " if self.summary else ""}Result stream, Detections and Sorted images
 Images containing animals: {counts['has animals']} ({has_animal_percentage}%)
 Images without animals: {counts['no animals']} ({no_animal_percentage}%)
 
@@ -244,3 +2260,245 @@ Images saved to folder
 {self.output_dir}"""
         return message
 
+def rethreshold(store_path, day_conf, night_conf, output_path=None, output_mode=None,
+                progress_callback=None, verbose=False, **kwargs):
+    """
+    Re-apply new day/night confidence values (percent, like app) to a saved
+    detections store. Writes a fresh report and sorted folders next to the
+    original run unless output_path is given.
+    """
+    with np.load(store_path) as data:
+        meta = json.loads(str(data['meta']))
+    runner = app(model=meta['model'],
+                 input_path=meta['input_path'],
+                 output_path=output_path or os.path.dirname(os.path.abspath(store_path)),
+                 output_mode=output_mode or meta['output_mode'],
+                 day_conf=day_conf,
+                 night_conf=night_conf,
+                 progress_callback=progress_callback,
+                 verbose=verbose,
+                 device="cpu",
+                 **kwargs)
+    return runner.rethreshold(store_path)
+
+
+# === Distributed runs over a shared filesystem ===
+# work_dir holds plan.json (timestamp, app settings and the image chunks),
+# lease_N while a node works on chunk N, part_N.<node>.* results of the
+# node that processed it and done_N (holding that node's name) when chunk N
+# is finished. Only atomic file operations are used, no broker.
+
+def _create_exclusive(path, text):
+    # True if this call created path
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    return True
+
+def load_plan(work_dir, chunk_size=500, node=None, **kwargs):
+    """
+    The plan of a distributed run, created by whichever node gets there
+    first: the listing of input_path cut into chunks of about chunk_size
+    images. With a sequence_policy, burst events are grouped once over the
+    whole listing and a chunk only ends between two events.
+    """
+    plan_path = os.path.join(work_dir, "plan.json")
+    if not os.path.isfile(plan_path):
+        os.makedirs(work_dir, exist_ok=True)
+        option = lambda name: kwargs.get(name, inspect.signature(app).parameters[name].default)
+        extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS if option("videos") else IMAGE_EXTENSIONS
+        images = list_images(kwargs["input_path"], option("recursive"), [kwargs["output_path"]], extensions)
+        events = None
+        if option("sequence_policy") != "off":
+            grouped = group_events([os.sep.join([kwargs["input_path"], f]) for f in images],
+                                   option("event_gap"), option("hash_threshold"), option("decode_threads"),
+                                   option("use_exif"))
+            events = {filename: [event_id, event_size, None if ref is None else images[ref]]
+                      for filename, (event_id, event_size, ref) in zip(images, grouped)}
+            # Frames of an event next to each other, in listing order
+            images = sorted(images, key=lambda filename: events[filename][0])
+        chunks = []
+        for filename in images:
+            if not chunks or (len(chunks[-1]) >= chunk_size
+                              and (events is None or events[filename][0] != events[chunks[-1][-1]][0])):
+                chunks.append([])
+            chunks[-1].append(filename)
+        plan = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+            "app": kwargs,
+            "chunks": chunks,
+            "events": events,
+        }
+        tmp = f"{plan_path}.{node or os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(plan, f)
+        try:
+            # link is atomic on NFS too and fails if another node won the race
+            os.link(tmp, plan_path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+    with open(plan_path) as f:
+        return json.load(f)
+
+class Lease():
+    """
+    Claim on one chunk: lease_N created with O_EXCL holding the node name,
+    its mtime refreshed by a heartbeat thread. A lease not refreshed for
+    lease_seconds belongs to a dead node and is taken over. Two nodes can
+    still end up on the same chunk (a stalled node that comes back), so
+    every node writes its own part files and done_N decides which are used.
+    """
+    def __init__(self, path, node, lease_seconds=300):
+        self.path = path
+        self.node = node
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        if _create_exclusive(self.path, self.node):
+            return self._start()
+        try:
+            expired = time.time() - os.path.getmtime(self.path) > self.lease_seconds
+        except FileNotFoundError:
+            expired = True
+        if not expired:
+            return False
+        stale = f"{self.path}.stale-{self.node}"
+        try:
+            # Only one node can move the expired lease away
+            os.rename(self.path, stale)
+            fresh = time.time() - os.path.getmtime(stale) <= self.lease_seconds
+        except FileNotFoundError:
+            return False
+        if fresh:
+            # Another node took it over (or its owner beat) since the check, put it back
+            with contextlib.suppress(OSError):
+                os.link(stale, self.path)
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        if _create_exclusive(self.path, self.node):
+            return self._start()
+        return False
+
+    def _start(self):
+        def beat():
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    os.utime(self.path)
+                except FileNotFoundError:
+                    return
+        self._thread = threading.Thread(target=beat, daemon=True)
+        self._thread.start()
+        return True
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            with open(self.path) as f:
+                owner = f.read()
+            # Taken over while this node stalled, the lease is the other node's now
+            if owner == self.node:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def run_node(work_dir, chunk_size=500, lease_seconds=300, poll=5.0, node=None, **kwargs):
+    """
+    Work on a distributed run until every chunk is done. Start the same
+    command on every node, kwargs are app arguments. Sorted images go
+    straight to the shared output folders, results to work_dir/part_N.<node>.*.
+    Call merge_parts once all nodes have finished.
+    """
+    node = node or f"{socket.gethostname()}-{os.getpid()}"
+    # Settings shared through plan.json, only the callbacks are this node's
+    local = {k: v for k, v in kwargs.items() if k in ('progress_callback', 'control')}
+    settings = {k: v for k, v in kwargs.items() if k not in local}
+    plan = load_plan(work_dir, chunk_size, node, **settings)
+    # Compared as plan.json holds them (tuples come back as lists)
+    settings = json.loads(json.dumps(settings))
+    if settings != plan["app"]:
+        changed = sorted(k for k in settings.keys() | plan["app"].keys() if settings.get(k) != plan["app"].get(k))
+        print(f"{node}: using the settings of the plan, ignoring {', '.join(changed)}")
+    runner = app(timestamp=plan["timestamp"], **plan["app"], **local)
+    if runner.autotune:
+        runner.tune()
+    chunks = plan["chunks"]
+    mine = 0
+    while True:
+        pending = [i for i in range(len(chunks)) if not os.path.exists(os.path.join(work_dir, f"done_{i}"))]
+        if not pending:
+            break
+        claimed = False
+        for i in pending:
+            lease = Lease(os.path.join(work_dir, f"lease_{i}"), node, lease_seconds)
+            if os.path.exists(os.path.join(work_dir, f"done_{i}")) or not lease.acquire():
+                continue
+            claimed = True
+            try:
+                if runner.verbose: print(f"{node} processing chunk {i} ({len(chunks[i])} images)")
+                runner.use_part_files(os.path.join(work_dir, f"part_{i}.{node}"))
+                runner.run(chunks[i], plan_events=plan.get("events"))
+                if runner.control is not None and runner.control.cancelled:
+                    # Left unfinished, another node (or the next start) redoes it
+                    return f"Node {node} cancelled after {mine} images"
+                # The first node to finish the chunk wins, merge_parts reads its parts
+                if _create_exclusive(os.path.join(work_dir, f"done_{i}"), node):
+                    mine += len(chunks[i])
+            finally:
+                lease.release()
+        if not claimed:
+            # The rest is leased by other nodes, wait for them or for a lease to expire
+            time.sleep(poll)
+    return f"Node {node} processed {mine} images, all {len(chunks)} chunks done\nRun merge_parts on {work_dir}"
+
+def merge_parts(work_dir, **overrides):
+    """
+    Combine the part results of a finished distributed run into the standard
+    JSONL/CSV stream, detections store and JSON/XLSX report.
+    """
+    with open(os.path.join(work_dir, "plan.json")) as f:
+        plan = json.load(f)
+    missing = [i for i in range(len(plan["chunks"])) if not os.path.exists(os.path.join(work_dir, f"done_{i}"))]
+    if missing:
+        raise RuntimeError(f"{len(missing)} chunks not done yet: {missing[:10]}")
+    runner = app(timestamp=plan["timestamp"], **{**plan["app"], **overrides})
+    counts = {'has animals':0, 'no animals':0}
+    stream = runner.open_stream()
+    parts = []
+    for i in range(len(plan["chunks"])):
+        with open(os.path.join(work_dir, f"done_{i}")) as f:
+            parts.append(os.path.join(work_dir, f"part_{i}.{f.read()}"))
+    try:
+        for part in parts:
+            with open(part + ".jsonl") as f:
+                for line in f:
+                    record = json.loads(line)
+                    stream.write(record)
+                    counts['has animals' if record["animals_detected"] > 0 else 'no animals'] += 1
+    finally:
+        stream.close()
+    DetectionStore.merge(runner.OUTPUT_DETECTIONS, [part + ".npz" for part in parts], {
+        "input_path": os.path.abspath(runner.IMAGE_DIR),
+        "model": runner.model_name,
+        "day_conf": runner.day_conf,
+        "night_conf": runner.night_conf,
+        "output_mode": runner.output_mode,
+        "timestamp": runner.timestamp,
+    })
+    runner.write_summary()
+    return f"""Merged {len(parts)} chunks
+Images containing animals: {counts['has animals']}
+Images without animals: {counts['no animals']}
+
+Result timestamp: {runner.timestamp}
+Images saved to folder
+{runner.output_dir}"""
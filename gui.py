@@ -129,9 +129,15 @@ class SimpleRunnerGUI(tk.Frame):
         btn_out.grid(row=row, column=2, sticky="e", **pad)
 
         row += 1
-        # Run button
+        # Run, pause and cancel buttons
         self.run_btn = ttk.Button(self, text="Run", command=self._on_run)
-        self.run_btn.grid(row=row, column=0, columnspan=3, sticky="ew", **pad)
+        self.run_btn.grid(row=row, column=0, sticky="ew", **pad)
+        self.pause_btn = ttk.Button(self, text="Pause", command=self._on_pause, state="disabled")
+        self.pause_btn.grid(row=row, column=1, sticky="ew", **pad)
+        self.cancel_btn = ttk.Button(self, text="Cancel", command=self._on_cancel, state="disabled")
+        self.cancel_btn.grid(row=row, column=2, sticky="ew", **pad)
+        # detection_code.RunControl of the current run, set once the run has started
+        self.control = None
 
         # Grid weight
         self.columnconfigure(1, weight=1)
@@ -197,12 +203,20 @@ class SimpleRunnerGUI(tk.Frame):
         # disable run button while running
         self.run_btn.config(state="disabled")
         self.status_var.set("Running...")
+        self.control = None
+        self._running = True
+        self.after(100, self._poll_progress)
 
         # Expect run_callback to call on_done when finished. Run in a thread to avoid blocking UI.
         def run_wrapper():
             try:
-                def progress_callback(processed: int, total: int):
-                    self.master.after(0, lambda: self._update_progress(processed, total))
+                # Imported here, loading the engine takes a while
+                import detection_code as dc
+                # The run publishes progress into control, the GUI polls it at
+                # its own rate instead of being called for every image
+                self.control = dc.RunControl()
+                self.master.after(0, lambda: (self.pause_btn.config(state="normal", text="Pause"),
+                                              self.cancel_btn.config(state="normal")))
                 # Provide an on_done callback that marshals back to main thread
                 def on_done(success: bool, message: str):
                     self.master.after(0, lambda: self._run_finished(success, message, output_path))
@@ -215,7 +229,7 @@ class SimpleRunnerGUI(tk.Frame):
                                   day_conf    = self.day_conf_scale_var.get(),
                                   night_conf  = self.night_conf_scale_var.get(),
                                   on_done=on_done,
-                                  progress_callback=progress_callback,
+                                  control=self.control,
                                   verbose=True)
             #except Exception as e:
             except KeyError:
@@ -223,9 +237,42 @@ class SimpleRunnerGUI(tk.Frame):
 
         threading.Thread(target=run_wrapper, daemon=True).start()
 
-    def _update_progress(self, processed: int, total: int):
+    def _poll_progress(self):
+        if self.control is not None and self.control.poll() is not None:
+            self._update_progress(*self.control.poll())
+        if self._running:
+            self.after(100, self._poll_progress)
+
+    def _on_pause(self):
+        if self.control is None:
+            return
+        if self.control.paused:
+            self.control.resume()
+            self.pause_btn.config(text="Pause")
+            self.status_var.set("Running...")
+        else:
+            self.control.pause()
+            self.pause_btn.config(text="Resume")
+            self.status_var.set("Paused")
+
+    def _on_cancel(self):
+        if self.control is None:
+            return
+        self.control.cancel()
+        self.pause_btn.config(state="disabled")
+        self.cancel_btn.config(state="disabled")
+        self.status_var.set("Cancelling, finishing the images in progress...")
+
+    def _update_progress(self, processed: int, total: int, event: Optional[dict] = None):
         self.progress_total = total
-        self.progress_label_var.set(f'Processed {processed}/{self.progress_total}')
+        text = f'Processed {processed}/{self.progress_total}'
+        if event is not None and event['images_per_sec'] > 0:
+            text += f" ({event['images_per_sec']:.1f}/s"
+            if event['eta'] is not None:
+                minutes, seconds = divmod(int(event['eta']), 60)
+                text += f", {minutes}:{seconds:02d} left"
+            text += ")"
+        self.progress_label_var.set(text)
         if self.progress_total > 0:
             percent = int(processed*100/self.progress_total)
             self.progressbar.config(mode='determinate', maximum=100)
@@ -233,7 +280,12 @@ class SimpleRunnerGUI(tk.Frame):
         #self.status_var.set(f"Processing")
 
     def _run_finished(self, success: bool, message: str, output_path: str):
+        self._running = False
+        if self.control is not None and self.control.poll() is not None:
+            self._update_progress(*self.control.poll())
         self.run_btn.config(state="normal")
+        self.pause_btn.config(state="disabled", text="Pause")
+        self.cancel_btn.config(state="disabled")
         self.status_var.set("" if success else f"Failed: {message}")
 
         # Show popup with message and button to open folder
@@ -294,10 +346,15 @@ if __name__ == "__main__":
     root = tk.Tk()
     root.title("Wildscan")
 
-    def real_run(model, input_path, output_path, output_mode, day_conf, night_conf, on_done, progress_callback, verbose=False):
+    def real_run(model, input_path, output_path, output_mode, day_conf, night_conf, on_done,
+                 progress_callback=None, control=None, verbose=False):
         def worker():
             import detection_code as dc
             try:
+                # Models stay warm between runs, only keep the selected one loaded
+                for other in dc.models_bl_dict:
+                    if other != model:
+                        dc.evict_models(other)
                 app = dc.app(model=model,
                              input_path=input_path,
                              output_path=output_path,
@@ -305,6 +362,7 @@ if __name__ == "__main__":
                              day_conf=day_conf,
                              night_conf=night_conf,
                              progress_callback=progress_callback,
+                             control=control,
                              verbose=verbose)
                 message = app.main()
                 on_done(True, message)
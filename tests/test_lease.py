@@ -0,0 +1,55 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("ultralytics")
+import detection_code as dc
+
+
+def expire(path, seconds=600):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_expired_lease_is_taken_over_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "lease_0")
+    dc._create_exclusive(path, "dead")
+    expire(path)
+
+    a = dc.Lease(path, "a", lease_seconds=60)
+    assert a.acquire()
+    with open(path) as f:
+        assert f.read() == "a"
+
+    # b saw the lease expired before a took it over and renames a's fresh lease
+    b = dc.Lease(path, "b", lease_seconds=60)
+    real_getmtime = os.path.getmtime
+    calls = []
+    def first_call_stale(p):
+        calls.append(p)
+        return real_getmtime(p) - 600 if len(calls) == 1 else real_getmtime(p)
+    monkeypatch.setattr(os.path, "getmtime", first_call_stale)
+    assert not b.acquire()
+    monkeypatch.setattr(os.path, "getmtime", real_getmtime)
+    with open(path) as f:
+        assert f.read() == "a"
+    assert not os.path.exists(path + ".stale-b")
+    a.release()
+    assert not os.path.exists(path)
+
+
+def test_release_keeps_a_lease_taken_over_by_another_node(tmp_path):
+    path = str(tmp_path / "lease_0")
+    slow = dc.Lease(path, "slow", lease_seconds=60)
+    assert slow.acquire()
+    slow._stop.set()
+    expire(path)
+
+    other = dc.Lease(path, "other", lease_seconds=60)
+    assert other.acquire()
+    slow.release()
+    with open(path) as f:
+        assert f.read() == "other"
+    other.release()
+    assert not os.path.exists(path)
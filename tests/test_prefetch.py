@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("ultralytics")
+import detection_code as dc
+
+
+def test_prefetch_keeps_order():
+    items = [(i, i) for i in range(50)]
+    assert list(dc.prefetch(iter(items), lambda x: x * 2, threads=4, depth=3)) == [(i, 2 * i) for i in range(50)]
+
+
+def test_prefetch_raises_a_failing_listing():
+    def items():
+        yield "a", 1
+        yield "b", 2
+        raise PermissionError("denied")
+
+    seen = []
+    with pytest.raises(PermissionError):
+        for key, value in dc.prefetch(items(), lambda x: x * 10, depth=1):
+            seen.append((key, value))
+    assert seen == [("a", 10), ("b", 20)]
@@ -0,0 +1,77 @@
+import os
+import json
+
+import pytest
+
+pytest.importorskip("ultralytics")
+import detection_code as dc
+
+
+def run_folder(src, out, detections, timestamp):
+    # A resumed run of src into out with the given confidences per file, no model involved
+    runner = dc.app("Best", str(src), str(out), "Original images", 15, 30, resume=True, timestamp=timestamp)
+
+    def detect(decoded):
+        for filename, frame in decoded:
+            conf = detections[filename]
+            yield filename, {
+                "scene": "day",
+                "conf_list": conf,
+                "xyxy": [[0.0, 0.0, 1.0, 1.0]] * len(conf),
+                "cls": [0] * len(conf),
+                "threshold": runner.day_conf,
+                "color_score": 20.0,
+                "img": None,
+                "scale": 1.0,
+            }
+
+    read = lambda path: (None, 1.0) if os.path.isfile(path) else None
+    runner.run(sorted(os.listdir(src)), detect, read)
+    return runner
+
+
+def test_cards_with_the_same_file_names_share_an_output_folder(tmp_path):
+    out = tmp_path / "out"
+    for card, content in (("A", b"card A"), ("B", b"card B")):
+        (tmp_path / card).mkdir()
+        (tmp_path / card / "IMG_0000.JPG").write_bytes(content)
+        (tmp_path / card / "IMG_0001.JPG").write_bytes(content)
+
+    a = run_folder(tmp_path / "A", out, {"IMG_0000.JPG": [0.9], "IMG_0001.JPG": [0.01]}, "2024-01-01_00-00-00")
+    b = run_folder(tmp_path / "B", out, {"IMG_0000.JPG": [0.01], "IMG_0001.JPG": [0.9]}, "2024-01-02_00-00-00")
+
+    # B starts a run of its own instead of resuming A's
+    assert b.timestamp == "2024-01-02_00-00-00"
+    assert b.manifest.path != a.manifest.path
+    with open(os.path.join(a.DETECTED_DIR, "IMG_0000.JPG"), "rb") as f:
+        assert f.read() == b"card A"
+    with open(os.path.join(a.UNDETECTED_DIR, "IMG_0001.JPG"), "rb") as f:
+        assert f.read() == b"card A"
+    with open(a.OUTPUT_JSON) as f:
+        assert json.load(f)["IMG_0000.JPG"]["animals_above_threshold"] == 1
+
+    # Both stay resumable
+    timestamp, entries = dc.RunManifest(a.manifest.path, a.run_settings()).load()
+    assert timestamp == "2024-01-01_00-00-00" and sorted(entries) == ["IMG_0000.JPG", "IMG_0001.JPG"]
+    again = dc.app("Best", str(tmp_path / "A"), str(out), "Original images", 15, 30, resume=True)
+    assert again.timestamp == "2024-01-01_00-00-00" and len(again.previous) == 2
+
+
+def test_manifest_ignores_a_torn_last_line(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    manifest = dc.RunManifest(path, {"model": "Best", "day_conf": 0.15})
+    manifest.open("2024-01-01_00-00-00")
+    manifest.add("IMG_0000.JPG", {"size": 1, "mtime_ns": 2}, {"animals_detected": 1})
+    manifest.add("IMG_0001.JPG", {"size": 3, "mtime_ns": 4}, {"animals_detected": 0})
+    manifest.close()
+    # A crash in the middle of a write
+    with open(path, "a") as f:
+        f.write('{"key": "IMG_0002.JPG", "identity": {"si')
+
+    timestamp, entries = dc.RunManifest(path, {"model": "Best", "day_conf": 0.15}).load()
+    assert timestamp == "2024-01-01_00-00-00"
+    assert sorted(entries) == ["IMG_0000.JPG", "IMG_0001.JPG"]
+    assert entries["IMG_0001.JPG"]["record"] == {"animals_detected": 0}
+
+    # Other settings are not resumed
+    assert dc.RunManifest(path, {"model": "Best", "day_conf": 0.5}).load() == (None, {})